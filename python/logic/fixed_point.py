@@ -0,0 +1,33 @@
+"""
+Module implementing the fixed-point encoding of coordinates used by OSM:
+int32 in 1e-7 degree units, 4 bytes per coordinate instead of 8 with about 1 cm precision
+"""
+
+# Third party imports
+import numpy as np
+
+# Fixed-point units in one degree
+SCALE = 10 ** 7
+
+FIXED_TYPE = np.dtype(np.int32)
+
+
+def to_fixed(values) -> np.ndarray:
+    """
+    Encodes degrees to fixed-point units, rounding to the nearest unit
+    :param values: Array-like of degrees, the absolute value must not exceed 180
+    :return: Array of int32 units
+    """
+    units = np.rint(np.asarray(values, dtype=np.float64) * SCALE)
+    if units.size and not np.all(np.abs(units) <= 180 * SCALE):
+        raise ValueError("Coordinates must be in the range [-180, 180]")
+    return units.astype(FIXED_TYPE)
+
+
+def from_fixed(units) -> np.ndarray:
+    """
+    Decodes fixed-point units to degrees
+    :param units: Array-like of int32 units
+    :return: Array of float64 degrees
+    """
+    return np.asarray(units, dtype=np.float64) / SCALE
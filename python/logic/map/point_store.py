@@ -0,0 +1,148 @@
+"""
+A module that implements the columnar storage of the objects found on the map:
+coordinates, OSM ids and types are kept in numpy arrays,
+the tags in an interned TagTable, an object is addressed by its row.
+With the fixed point the coordinates are kept as int32 in 1e-7 degree units, as OSM gives them
+"""
+
+# Standard library import
+from itertools import zip_longest
+from typing import Iterable, Iterator, Tuple, Union
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+from ..point import Point
+from ..fixed_point import SCALE, to_fixed, from_fixed
+from ..tree.tree_map import KdTreeMap
+from .tag_table import TagTable
+
+
+class PointStore:
+    # OSM element types in the order of their codes
+    TYPES = ("node", "way", "relation")
+    NODE, WAY, RELATION = range(len(TYPES))
+
+    def __init__(self, lats=(), lons=(), osm_ids=(), osm_types=(), tags: Union[TagTable, Iterable[dict]] = (),
+                 fixed_point: bool = False):
+        """
+        Initializing the storage from the columns, all columns must have the same length
+        :param lats: Array-like of latitudes
+        :param lons: Array-like of longitudes
+        :param osm_ids: Array-like of OSM ids
+        :param osm_types: Array-like of OSM element type codes, indices of TYPES
+        :param tags: TagTable or dicts with the tags of the objects
+        :param fixed_point: Keep the coordinates as int32 in 1e-7 degree units
+        """
+        self._fixed_point = fixed_point
+        self._lats = to_fixed(lats) if fixed_point else np.asarray(lats, dtype=np.float64)
+        self._lons = to_fixed(lons) if fixed_point else np.asarray(lons, dtype=np.float64)
+        self._osm_ids = np.asarray(osm_ids, dtype=np.int64)
+        self._osm_types = np.asarray(osm_types, dtype=np.int8)
+        self._tags = tags if isinstance(tags, TagTable) else TagTable.from_dicts(tags)
+
+        if not len(self._lats) == len(self._lons) == len(self._osm_ids) == len(self._osm_types) == len(self._tags):
+            raise ValueError("All columns must have the same length")
+
+    def __len__(self):
+        return len(self._lats)
+
+    @classmethod
+    def from_result(cls, result, fixed_point: bool = False) -> "PointStore":
+        """
+        Collects the objects of the overpy result, ways and relations are located by their centers
+        :param result: Query Result from overpy
+        :param fixed_point: Keep the coordinates as int32 in 1e-7 degree units
+        :return: Storage with the objects of the result
+        """
+        lats, lons, osm_ids, osm_types, tags = [], [], [], [], []
+
+        def append(lat, lon, element, osm_type: int) -> None:
+            lats.append(float(lat))
+            lons.append(float(lon))
+            osm_ids.append(element.id)
+            osm_types.append(osm_type)
+            tags.append(element.tags)
+
+        for node, way, rel in zip_longest(result.nodes, result.ways, result.relations):
+            if rel:
+                append(rel.center_lat, rel.center_lon, rel, cls.RELATION)
+            if way:
+                append(way.center_lat, way.center_lon, way, cls.WAY)
+            if node:
+                append(node.lat, node.lon, node, cls.NODE)
+
+        return cls(lats, lons, osm_ids, osm_types, tags, fixed_point)
+
+    @property
+    def fixed_point(self) -> bool:
+        """
+        :return: Whether the coordinates are kept as int32 in 1e-7 degree units
+        """
+        return self._fixed_point
+
+    @property
+    def lats(self) -> np.ndarray:
+        """
+        Get latitudes of the objects, decoded into a new array with the fixed point
+        :return: Array of latitudes in degrees
+        """
+        return from_fixed(self._lats) if self._fixed_point else self._lats
+
+    @property
+    def lons(self) -> np.ndarray:
+        """
+        Get longitudes of the objects, decoded into a new array with the fixed point
+        :return: Array of longitudes in degrees
+        """
+        return from_fixed(self._lons) if self._fixed_point else self._lons
+
+    @property
+    def osm_ids(self) -> np.ndarray:
+        """
+        Get OSM ids of the objects
+        :return: Array of OSM ids
+        """
+        return self._osm_ids
+
+    @property
+    def osm_types(self) -> np.ndarray:
+        """
+        Get OSM element type codes of the objects
+        :return: Array of indices of TYPES
+        """
+        return self._osm_types
+
+    @property
+    def tags(self) -> TagTable:
+        """
+        Get tags of the objects
+        :return: Table decoding the tags of a row into a dict when accessed
+        """
+        return self._tags
+
+    def point(self, row: int) -> Point:
+        """
+        Get location of the object
+        :param row: Row of the object
+        :return: Point (latitude, longitude)
+        """
+        lat, lon = self._lats[row].item(), self._lons[row].item()
+        if self._fixed_point:
+            lat, lon = lat / SCALE, lon / SCALE
+        return Point(float(lat), float(lon))
+
+    def rows(self) -> Iterator[Tuple[int, float, float, dict]]:
+        """
+        Iterates over the objects without creating points, the tags are decoded on the way
+        :return: Iterator over (row, latitude, longitude, tags)
+        """
+        return zip(range(len(self)), self.lats.tolist(), self.lons.tolist(), self._tags)
+
+    def build_tree(self) -> KdTreeMap:
+        """
+        Builds a k-d tree over the objects, the data of every node is the row of its object
+        :return: Built tree
+        """
+        return KdTreeMap.from_arrays(self.lats, self.lons)
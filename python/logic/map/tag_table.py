@@ -0,0 +1,84 @@
+"""
+A module that implements the compact storage of the OSM tags of the objects on the map.
+Keys and values are interned in shared tables, the tags of every object
+are kept as (key, value) index pairs and decoded into a dict only when accessed
+"""
+
+# Standard library import
+from typing import Iterable, List
+
+# Third party imports
+import numpy as np
+
+
+class TagTable:
+    def __init__(self, keys: List[str], values: list, offsets: np.ndarray, pairs: np.ndarray):
+        """
+        Initializing the table from the interned tables and the pairs
+        :param keys: Interned keys
+        :param values: Interned values
+        :param offsets: Start of the pairs of every object and the end of the pairs
+        :param pairs: (key index, value index) of all objects one after another
+        """
+        self._keys = keys
+        self._values = values
+        self._offsets = offsets
+        self._pairs = pairs
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, row: int) -> dict:
+        """
+        Decodes the tags of the object
+        :param row: Row of the object
+        :return: New dict with the tags
+        """
+        if not -len(self) <= row < len(self):
+            raise IndexError("Tag row out of range")
+        row %= len(self)
+
+        keys = self._keys
+        values = self._values
+        start, end = self._offsets[row:row + 2].tolist()
+        return {keys[key]: values[value] for key, value in self._pairs[start:end].tolist()}
+
+    def __iter__(self):
+        keys = self._keys
+        values = self._values
+        offsets = self._offsets.tolist()
+        # One flat list instead of a list per pair
+        flat_pairs = self._pairs.ravel().tolist()
+
+        for start, end in zip(offsets, offsets[1:]):
+            pairs = iter(flat_pairs[2 * start:2 * end])
+            yield {keys[key]: values[value] for key, value in zip(pairs, pairs)}
+
+    @classmethod
+    def from_dicts(cls, tags: Iterable[dict]) -> "TagTable":
+        """
+        Interns the keys and the values of the dicts
+        :param tags: Tags of every object
+        :return: Table with the tags
+        """
+        keys, key_index = [], {}
+        values, value_index = [], {}
+        counts, flat_pairs = [], []
+
+        for object_tags in tags:
+            counts.append(len(object_tags))
+            for key, value in object_tags.items():
+                if key not in key_index:
+                    key_index[key] = len(keys)
+                    keys.append(key)
+                if value not in value_index:
+                    value_index[value] = len(values)
+                    values.append(value)
+                flat_pairs.append(key_index[key])
+                flat_pairs.append(value_index[value])
+
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        pairs = np.array(flat_pairs, dtype=np.int32).reshape(-1, 2)
+
+        return cls(keys, values, offsets, pairs)
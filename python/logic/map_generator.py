@@ -3,8 +3,7 @@ The module generates the folium map
 """
 
 # Standard library import
-from itertools import zip_longest
-from typing import Union, Tuple, List
+from typing import Union, Set
 
 # Third party imports
 import folium
@@ -16,7 +15,7 @@ from .tree.tree_map import KdTreeMap
 from .map.queries import Query
 from .map.web_source import JAVA_SCRIPT, HTML
 from .map.web_parser import WebParser
-from .map.data_point import DataPoint
+from .map.point_store import PointStore
 from python.json_connect.json_connector import JsonConnector
 from .map_interface import IMap
 
@@ -31,10 +30,11 @@ class Map(IMap):
         Initializing the folium card generation object
         """
 
-        # [ DataPoint(), DataPoint()]
+        # PointStore with the found objects
         self._points_on_map = None
         self._user_query = None
-        self._tree = KdTreeMap()
+        # Tree over the found objects, built on the first query and reset when the objects change
+        self._tree = None
         self._query = Query()
 
         self._current_zoom = self.STANDARD_ZOOM
@@ -62,10 +62,10 @@ class Map(IMap):
         # If any objects were found
         if self._points_on_map:
             # Just take the location of the first point
-            location = self._points_on_map[0].point
+            location = self._points_on_map.point(0)
 
         new_map = self._pure_custom_map(location=location)
-        self._points_on_map = None
+        self._set_points(None)
         return new_map
 
     def find_objects(self, query: str, start_point: Point, end_point: Point) -> Union[folium.Map, None]:
@@ -85,34 +85,31 @@ class Map(IMap):
             query_res = self._query.query_by_name(query, start_point.points, end_point.points)
 
         self._user_query = query
-        self._points_on_map = self._unpack_query_answer(query_res)
+        self._set_points(self._unpack_query_answer(query_res))
 
         if not self._points_on_map:
             return None
 
         middle_point = start_point.middle_point(end_point)
-        new_map = self._build(target_point=None, location=middle_point)
+        new_map = self._build(target_rows=None, location=middle_point)
         return new_map
 
-    def nearest_object(self, pivot: Point) -> Union[folium.Map, None]:
+    def nearest_object(self, pivot: Point, count: int = 1) -> Union[folium.Map, None]:
         """
         Searches the current map for the nearest
-        object to the point, then marks the nearest
-        object to it, and returns a modified map
+        objects to the point, then marks the nearest
+        objects to it, and returns a modified map
         :param pivot: The point for which the nearest object is searched for
+        :param count: How many nearest objects to mark
         :return: Modified map or None if null objects on map
         """
         if not self._points_on_map:
             return None
 
-        packed_data = self.pack_map_points(self._points_on_map)
-        self._tree.rebuild_tree(packed_data)
-
-        closest = self._tree.closest_node(pivot)
-
-        closest_point = closest.point
+        # The data of the nodes are the rows of the objects
+        closest_rows = [node.data for node in self._get_tree().k_closest_nodes(pivot, count)]
 
-        new_map = self._build(closest_point, closest_point)
+        new_map = self._build(set(closest_rows), self._points_on_map.point(closest_rows[0]))
 
         # Here I add a user point to the map
         folium.Marker(
@@ -126,27 +123,57 @@ class Map(IMap):
 
         return new_map
 
-    def _build(self, target_point: Union[Point, None], location: Point) -> folium.Map:
+    def count_objects_in_radius(self, pivot: Point, radius: float) -> int:
+        """
+        Counts the objects on the current map which are
+        not further than radius from the point
+        :param pivot: Center of the search
+        :param radius: Search radius in metres
+        :return: Number of objects, 0 if null objects on map
+        """
+        if not self._points_on_map:
+            return 0
+
+        return self._get_tree().count_within_radius(pivot, radius)
+
+    def _set_points(self, points: Union[PointStore, None]) -> None:
+        """
+        Replaces the found objects, the tree over the previous ones is dropped
+        :param points: Storage with the found objects or None
+        :return: None
+        """
+        self._points_on_map = points
+        self._tree = None
+
+    def _get_tree(self) -> KdTreeMap:
+        """
+        Get the tree over the found objects, it is built once for every set of objects
+        :return: Tree whose node data are the rows of the objects
+        """
+        if self._tree is None:
+            self._tree = self._points_on_map.build_tree()
+        return self._tree
+
+    def _build(self, target_rows: Union[Set[int], None], location: Point) -> folium.Map:
         """
         The method generates a folium map
-        :param target_point: If not none, when building the map,
-        the generator will highlight this point with a special color
+        :param target_rows: If not none, when building the map,
+        the generator will highlight the objects of these rows with a special color
         :param location: What coordinates to focus after building the map
         :return: New folium map
         """
         new_map = self._pure_custom_map(location=location, zoom=self._current_zoom)
 
-        for point_obj in self._points_on_map:
-            point_data = self._html_marker(point_obj.data)
-            point = point_obj.point
+        for row, lat, lon, tags in self._points_on_map.rows():
+            point_data = self._html_marker(tags)
 
             folium.Marker(
                 # Set cords
-                point.points,
+                (lat, lon),
                 icon=folium.Icon(
                     icon=self._standard_icons.get(self._user_query, self.DEFAULT_ICON),
-                    # If the target has been passed, set its color to green, set the others to blue
-                    color='green' if target_point and target_point == point else 'blue',
+                    # If the targets have been passed, set their color to green, set the others to blue
+                    color='green' if target_rows and row in target_rows else 'blue',
                     prefix="fa"),
                 popup=folium.Popup(folium.IFrame(point_data),
                                    min_width=150,
@@ -175,34 +202,13 @@ class Map(IMap):
         return f_map
 
     @staticmethod
-    def _unpack_query_answer(answer_query: overpy.Result) -> list:
+    def _unpack_query_answer(answer_query: overpy.Result) -> PointStore:
         """
-        Returns a list of points that show the location
-        of an object on the map, by type of query
+        Returns the storage of the objects on the map, by type of query
         :param answer_query: Query Result from overpy
-        :return: Data Points list
-        """
-        data_points_list = []
-        for node, way, rel in zip_longest(answer_query.nodes, answer_query.ways, answer_query.relations):
-            if rel:
-                data_points_list.append(
-                    DataPoint(
-                        Point(float(rel.center_lat), float(rel.center_lon)), rel.tags
-                    )
-                )
-            if way:
-                data_points_list.append(
-                    DataPoint(
-                        Point(float(way.center_lat), float(way.center_lon)), way.tags
-                    )
-                )
-            if node:
-                data_points_list.append(
-                    DataPoint(
-                        Point(float(node.lat), float(node.lon)), node.tags
-                    )
-                )
-        return data_points_list
+        :return: Point storage
+        """
+        return PointStore.from_result(answer_query)
 
     @staticmethod
     def _html_marker(point_data: dict) -> str:
@@ -212,16 +218,3 @@ class Map(IMap):
         :return: HTML as string
         """
         return f"""Name: {point_data.get('name', 'n/a')}<br>Amenity: {point_data.get('amenity', 'n/a')}"""
-
-    @staticmethod
-    def pack_map_points(unpacked_answer: List[DataPoint]) -> Tuple[Tuple[Point, Union[dict, None]], ...]:
-        """
-        Converts the DataPoint type that the map_generator works with,
-        to the data type that the KD-tree receives as input
-        :param unpacked_answer: Data point list
-        :return: Tuple as input KD-tree
-        """
-        result = []
-        for item in unpacked_answer:
-            result.append(item.tuple_data)
-        return tuple(result)
@@ -47,11 +47,23 @@ class IMap(ABC):
         pass
 
     @abstractmethod
-    def nearest_object(self, pivot: Point) -> Union[folium.Map, None]:
+    def nearest_object(self, pivot: Point, count: int = 1) -> Union[folium.Map, None]:
         """
-        Returns the map, with the marked object nearest to the point,
+        Returns the map, with the marked objects nearest to the point,
         if there are no objects on the map, returns None
         :param pivot: Point for which to look for the nearest object
+        :param count: How many nearest objects to mark
         :return: Map if the nearest object is found, otherwise None
         """
         pass
+
+    @abstractmethod
+    def count_objects_in_radius(self, pivot: Point, radius: float) -> int:
+        """
+        Returns the number of objects on the map,
+        which are not further than radius from the point
+        :param pivot: Center of the search
+        :param radius: Search radius in metres
+        :return: Number of objects
+        """
+        pass
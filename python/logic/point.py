@@ -11,6 +11,8 @@ class Point:
     Class implementing the Point of Node location
     """
 
+    __slots__ = ("_x", "_y")
+
     def __init__(self, x: float = None, y: float = None):
         self._x = x
         self._y = y
@@ -33,6 +35,10 @@ class Point:
             return True
         return False
 
+    def __hash__(self):
+        # Equal points have equal hashes, a point must not be changed while it is a key of a dict or a set
+        return hash((self._x, self._y))
+
     def euclidean_distance(self, point) -> float:
         """
         Calculates the Euclidean distance between two points
@@ -96,3 +102,25 @@ class Point:
         :return: None
         """
         self._y = new_y
+
+
+class FrozenPoint(Point):
+    """
+    Immutable Point, safe to use as a key of a dict or a set
+    """
+
+    __slots__ = ()
+
+    @property
+    def x(self) -> float:
+        """
+        :return: Get x coordinate
+        """
+        return self._x
+
+    @property
+    def y(self) -> float:
+        """
+        :return: Get y coordinate
+        """
+        return self._y
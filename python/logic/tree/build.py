@@ -0,0 +1,375 @@
+"""
+Module implementing the level by level median split of points,
+on which the k-d trees are built
+"""
+
+# Standard library import
+import math
+from typing import TYPE_CHECKING, Iterator, Tuple, Union
+
+# Third party imports
+import numpy as np
+
+DIMENSION = 2
+
+# Smaller inputs are built in one process, there starting the pool costs more than the build
+PARALLEL_MIN_SIZE = 100000
+
+LEVEL = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, Union[np.ndarray, None]]
+LINKS = Tuple[int, np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+if TYPE_CHECKING:
+    from multiprocessing.shared_memory import SharedMemory
+
+
+def split_levels(xs: np.ndarray, ys: np.ndarray, depth: int = 0, with_bounds: bool = False) -> Iterator[LEVEL]:
+    """
+    Splits the points into the levels of a balanced k-d tree. The points are sorted once per axis,
+    after that every level is a linear stable partition of the index arrays,
+    so the whole split costs O(n log n) without copying point lists.
+    The median is the middle point in the order of (axis, other axis, input position),
+    so the points equal to it are split between both subtrees and repeated points still give a balanced tree
+    :param xs: X coordinates of the points
+    :param ys: Y coordinates of the points
+    :param depth: Depth of the tree root, defines the first splitting axis
+    :param with_bounds: Calculate the bounding boxes of the subtrees
+    :return: Generator of levels from the root down, every level is a tuple of arrays:
+    point indices of the medians, sizes of their subtrees, sizes of their left subtrees,
+    indices of their parents in the previous level, flags whether they are left children
+    and bounding boxes (min_x, min_y, max_x, max_y) of their subtrees or None
+    """
+    length = len(xs)
+    axis_coords = [np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)]
+
+    # Index arrays sorted by (x, y) and by (y, x), lexsort is stable, so equal points keep input order
+    orders = [np.lexsort((axis_coords[1], axis_coords[0])), np.lexsort((axis_coords[0], axis_coords[1]))]
+
+    # The current level consists of segments, each segment is one subtree in both index arrays
+    seg_start = np.zeros(1 if length else 0, dtype=np.int64)
+    seg_size = np.full(len(seg_start), length, dtype=np.int64)
+    # Parent of every segment (index in the previous level medians) and its side
+    seg_parent = np.zeros(len(seg_start), dtype=np.int64)
+    seg_left = np.ones(len(seg_start), dtype=bool)
+
+    side = np.empty(length, dtype=np.int8)
+
+    while len(seg_size):
+        axis = depth % DIMENSION
+        sorted_idx = orders[axis]
+        other_idx = orders[1 - axis]
+        segments = len(seg_size)
+        count = len(sorted_idx)
+
+        positions = np.arange(count)
+        seg_of = np.repeat(np.arange(segments), seg_size)
+        median_pos = seg_start + seg_size // 2
+        left_size = median_pos - seg_start
+        right_size = seg_size - left_size - 1
+
+        bounds = None
+        if with_bounds:
+            # Segments cover the whole index array, so reduceat gives the extent of every segment
+            seg_xs = axis_coords[0][sorted_idx]
+            seg_ys = axis_coords[1][sorted_idx]
+            bounds = np.column_stack((np.minimum.reduceat(seg_xs, seg_start),
+                                      np.minimum.reduceat(seg_ys, seg_start),
+                                      np.maximum.reduceat(seg_xs, seg_start),
+                                      np.maximum.reduceat(seg_ys, seg_start)))
+
+        yield sorted_idx[median_pos], seg_size, left_size, seg_parent, seg_left, bounds
+
+        # 0 - left subtree, 1 - median, 2 - right subtree
+        side[sorted_idx] = np.sign(positions - median_pos[seg_of]) + 1
+
+        # Every segment loses its median
+        new_start = seg_start - np.arange(segments)
+
+        # The sorted array only loses medians, the order inside the new segments is kept
+        orders[axis] = sorted_idx[side[sorted_idx] != 1]
+
+        # Stable partition of the other array inside each segment
+        other_side = side[other_idx]
+        is_left = other_side == 0
+        is_right = other_side == 2
+        left_rank = np.cumsum(is_left) - is_left
+        right_rank = np.cumsum(is_right) - is_right
+        left_rank -= left_rank[seg_start][seg_of]
+        right_rank -= right_rank[seg_start][seg_of]
+        new_pos = np.where(is_left,
+                           new_start[seg_of] + left_rank,
+                           new_start[seg_of] + left_size[seg_of] + right_rank)
+        keep = other_side != 1
+        partitioned = np.empty(count - segments, dtype=other_idx.dtype)
+        partitioned[new_pos[keep]] = other_idx[keep]
+        orders[1 - axis] = partitioned
+
+        # Next level segments: left and right subtree of every median, empty ones are dropped
+        next_start = np.column_stack((new_start, new_start + left_size)).ravel()
+        next_size = np.column_stack((left_size, right_size)).ravel()
+
+        non_empty = next_size > 0
+        seg_start = next_start[non_empty]
+        seg_size = next_size[non_empty]
+        seg_parent = np.repeat(np.arange(segments), 2)[non_empty]
+        seg_left = np.tile([True, False], segments)[non_empty]
+        depth += 1
+
+
+def build_links(xs: np.ndarray, ys: np.ndarray, depth: int = 0, processes: int = 1) -> LINKS:
+    """
+    Builds the balanced k-d tree as arrays indexed by the points.
+    With several processes the top log2(processes) levels are split here, the subtrees under them
+    are built by a process pool over arrays in shared memory, the result is the same as with one process
+    :param xs: X coordinates of the points
+    :param ys: Y coordinates of the points
+    :param depth: Depth of the tree root, defines the first splitting axis
+    :param processes: Number of processes
+    :return: Index of the root point (-1 for no points), indices of the left and right children
+    (-1 for no child), subtree sizes and subtree bounding boxes (min_x, min_y, max_x, max_y)
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    length = len(xs)
+
+    if processes <= 1 or length < PARALLEL_MIN_SIZE:
+        links = _empty_links(length)
+        root = _fill_links(xs, ys, depth, *links)
+        return (root,) + links
+
+    # Shared memory needs Python 3.8, it is imported only for the parallel build
+    from multiprocessing.shared_memory import SharedMemory
+
+    block = SharedMemory(create=True, size=length * _LINKS_ROW_SIZE)
+    shared_xs, shared_ys, *links = _shared_links(block, length)
+    try:
+        shared_xs[:] = xs
+        shared_ys[:] = ys
+        # The block is zeroed, -1 marks no child
+        links[0].fill(-1)
+        links[1].fill(-1)
+        root = _fill_links_parallel(block.name, shared_xs, shared_ys, depth, processes, links)
+        # Copy out of the block before it is released
+        return (root,) + tuple(np.array(array) for array in links)
+    finally:
+        # The views have to be released before the block is closed
+        del shared_xs, shared_ys, links
+        block.close()
+        block.unlink()
+
+
+def tree_levels(xs: np.ndarray, ys: np.ndarray, depth: int = 0, processes: int = 1) -> Iterator[LEVEL]:
+    """
+    Get the levels of the tree with the bounds,
+    the levels are the same for any number of processes
+    :param xs: X coordinates of the points
+    :param ys: Y coordinates of the points
+    :param depth: Depth of the tree root, defines the first splitting axis
+    :param processes: Number of processes
+    :return: Iterator over the levels in the format of split_levels
+    """
+    if processes <= 1 or len(xs) < PARALLEL_MIN_SIZE:
+        return split_levels(xs, ys, depth, with_bounds=True)
+    return link_levels(build_links(xs, ys, depth, processes))
+
+
+def link_levels(links: LINKS) -> Iterator[LEVEL]:
+    """
+    Walks the tree of build_links level by level, the levels have the format of split_levels with the bounds
+    :param links: Result of build_links
+    :return: Iterator over the levels
+    """
+    root, left, right, sizes, bounds = links
+    if root < 0:
+        return
+
+    # -1 for no child picks the zero size at the end
+    child_sizes = np.append(sizes, 0)
+    medians = np.array([root], dtype=np.int64)
+    seg_parent = np.zeros(1, dtype=np.int64)
+    seg_left = np.ones(1, dtype=bool)
+
+    while len(medians):
+        yield (medians, sizes[medians], child_sizes[left[medians]], seg_parent, seg_left, bounds[medians])
+
+        children = np.stack((left[medians], right[medians]), axis=1).ravel()
+        present = children >= 0
+        seg_parent = np.repeat(np.arange(len(medians)), 2)[present]
+        seg_left = np.tile((True, False), len(medians))[present]
+        medians = children[present]
+
+
+# Bytes per point of the shared block: coordinates, children, size and bounding box
+_LINKS_ROW_SIZE = 2 * 8 + 3 * 8 + 4 * 8
+
+
+def _empty_links(length: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Allocates the link arrays
+    :param length: Number of points
+    :return: Left children, right children, sizes, bounding boxes
+    """
+    return (np.full(length, -1, dtype=np.int64), np.full(length, -1, dtype=np.int64),
+            np.zeros(length, dtype=np.int64), np.zeros((length, 4), dtype=np.float64))
+
+
+def _shared_links(block: "SharedMemory", length: int) -> list:
+    """
+    Creates the arrays in the shared block
+    :param block: Shared memory block of length * _LINKS_ROW_SIZE bytes
+    :param length: Number of points
+    :return: X coordinates, y coordinates, left children, right children, sizes, bounding boxes
+    """
+    arrays = []
+    offset = 0
+    for dtype, shape in ((np.float64, (length,)), (np.float64, (length,)), (np.int64, (length,)),
+                         (np.int64, (length,)), (np.int64, (length,)), (np.float64, (length, 4))):
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)
+        arrays.append(array)
+        offset += array.nbytes
+    return arrays
+
+
+def _fill_links(xs: np.ndarray, ys: np.ndarray, depth: int, left: np.ndarray, right: np.ndarray,
+                sizes: np.ndarray, bounds: np.ndarray) -> int:
+    """
+    Fills the link arrays from the levels of split_levels
+    :param xs: X coordinates of the points
+    :param ys: Y coordinates of the points
+    :param depth: Depth of the tree root
+    :param left: Array for the left children
+    :param right: Array for the right children
+    :param sizes: Array for the subtree sizes
+    :param bounds: Array for the subtree bounding boxes
+    :return: Index of the root point or -1 for no points
+    """
+    root = -1
+    parents = None
+
+    for medians, seg_size, _, seg_parent, seg_left, seg_bounds in split_levels(xs, ys, depth, with_bounds=True):
+        sizes[medians] = seg_size
+        bounds[medians] = seg_bounds
+
+        if parents is None:
+            root = int(medians[0])
+        else:
+            parent_points = parents[seg_parent]
+            left[parent_points[seg_left]] = medians[seg_left]
+            right[parent_points[~seg_left]] = medians[~seg_left]
+
+        parents = medians
+
+    return root
+
+
+def _fill_links_parallel(name: str, xs: np.ndarray, ys: np.ndarray, depth: int, processes: int,
+                         links: list) -> int:
+    """
+    Splits the top levels point by point, then builds the subtrees under them in the pool
+    :param name: Name of the shared block with the arrays
+    :param xs: X coordinates of the points in the block
+    :param ys: Y coordinates of the points in the block
+    :param depth: Depth of the tree root
+    :param processes: Number of processes
+    :param links: Left children, right children, sizes and bounding boxes in the block
+    :return: Index of the root point
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    left, right, sizes, bounds = links
+    coords = (xs, ys)
+    top_levels = math.ceil(math.log2(processes))
+
+    root = -1
+    tasks = []
+    # (point indices in ascending order, depth, parent point, whether it is the left child)
+    stack = [(np.arange(len(xs)), depth, -1, True)]
+
+    while stack:
+        subset, level, parent, is_left = stack.pop()
+        if not len(subset):
+            continue
+
+        if level - depth == top_levels:
+            tasks.append((subset, level, parent, is_left))
+            continue
+
+        # The same median as in split_levels: the middle point in the order of (axis, other axis, index),
+        # found by selection instead of sorting
+        axis = level % DIMENSION
+        key = coords[axis][subset]
+        half = len(key) // 2
+        value = np.partition(key, half)[half]
+        below = key < value
+        equal = np.flatnonzero(key == value)
+        # The subset is in ascending order and the sort is stable, so the ties keep the order of the index
+        equal = equal[np.argsort(coords[1 - axis][subset[equal]], kind="stable")]
+        rank = half - np.count_nonzero(below)
+        median = int(subset[equal[rank]])
+        below[equal[:rank]] = True
+        above = ~below
+        above[equal[rank]] = False
+
+        sizes[median] = len(subset)
+        bounds[median] = (xs[subset].min(), ys[subset].min(), xs[subset].max(), ys[subset].max())
+        root = _link_child(root, left, right, parent, is_left, median)
+
+        # Masks keep the subsets in ascending order
+        stack.append((subset[below], level + 1, median, True))
+        stack.append((subset[above], level + 1, median, False))
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        subtree_roots = executor.map(_build_subtree, [name] * len(tasks), [len(xs)] * len(tasks),
+                                     [subset for subset, _, _, _ in tasks], [level for _, level, _, _ in tasks])
+
+        for (_, _, parent, is_left), subtree_root in zip(tasks, subtree_roots):
+            root = _link_child(root, left, right, parent, is_left, subtree_root)
+
+    return root
+
+
+def _link_child(root: int, left: np.ndarray, right: np.ndarray, parent: int, is_left: bool, child: int) -> int:
+    """
+    Links the child to the parent point
+    :param root: Current root point
+    :param left: Left children
+    :param right: Right children
+    :param parent: Parent point or -1 if the child is the root
+    :param is_left: Whether the child is the left one
+    :param child: Child point
+    :return: Root point
+    """
+    if parent < 0:
+        return child
+
+    (left if is_left else right)[parent] = child
+    return root
+
+
+def _build_subtree(name: str, length: int, subset: np.ndarray, depth: int) -> int:
+    """
+    Builds the subtree of the points in a pool process and writes its links to the shared block
+    :param name: Name of the shared block
+    :param length: Number of all points
+    :param subset: Indices of the subtree points in ascending order
+    :param depth: Depth of the subtree root
+    :return: Index of the subtree root point
+    """
+    from multiprocessing.shared_memory import SharedMemory
+
+    block = SharedMemory(name=name)
+    xs, ys, left, right, sizes, bounds = _shared_links(block, length)
+    try:
+        local_left, local_right, local_sizes, local_bounds = _empty_links(len(subset))
+        local_root = _fill_links(xs[subset], ys[subset], depth, local_left, local_right, local_sizes, local_bounds)
+
+        # Local indices to the indices of all points, -1 stays for no child
+        global_index = np.append(subset, -1)
+        left[subset] = global_index[local_left]
+        right[subset] = global_index[local_right]
+        sizes[subset] = local_sizes
+        bounds[subset] = local_bounds
+
+        return int(subset[local_root])
+    finally:
+        del xs, ys, left, right, sizes, bounds
+        block.close()
@@ -0,0 +1,495 @@
+"""
+Module implementing the k-d tree stored in flat arrays
+"""
+
+# Standard library import
+import math
+import multiprocessing
+import os
+import sys
+import weakref
+from typing import TYPE_CHECKING, Union, List, Tuple
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+from ..point import Point
+from ..fixed_point import SCALE, FIXED_TYPE, to_fixed
+from .node import Node
+from .tree import KdTree
+from .build import split_levels
+from .storage import (LAYOUT_IMPLICIT, LAYOUT_IMPLICIT_FIXED, save_tree, load_tree, dump_tree, dump_payloads,
+                      parse_tree, parse_payloads)
+
+if TYPE_CHECKING:
+    from multiprocessing.shared_memory import SharedMemory
+
+# Names of the shared memory blocks created by share in this process and not released yet
+_PUBLISHED_BLOCKS = set()
+
+
+class FlatKdTree:
+    """
+    The class that implements a static KD tree without per-node objects.
+    The coordinates are kept in contiguous numpy arrays in the balanced layout:
+    the root of the subtree [lo, hi) is in the middle of the range, its left subtree
+    is [lo, mid) and its right subtree is [mid + 1, hi), so the children are not stored.
+    The data of the points is kept in a side table and referenced by integer ids.
+    Subtrees not larger than the leaf size are leaves, their points are checked at once with numpy.
+    With the fixed point the coordinates are degrees kept as int32 in 1e-7 units,
+    they are converted only when the points are given to the tree or returned from it.
+    The distance is euclidean on the raw coordinates, FlatKdTreeMap measures it on the sphere as KdTreeMap
+    """
+    INIT_TREE = KdTree.INIT_TREE
+
+    DIMENSION = 2
+
+    def __init__(self, init_data: INIT_TREE = None, leaf_size: int = 1, fixed_point: bool = False):
+        """
+        Builds a flat k-d tree based on the tuple of Points and Data
+        :param init_data: Tuple with points and data by which to build a tree
+        :param leaf_size: Maximum number of points in a leaf, 16 - 64 suits large trees
+        :param fixed_point: Keep the coordinates as int32 in 1e-7 degree units,
+        the coordinates must be degrees in [-180, 180] and are rounded to about 1 cm
+        """
+        if leaf_size < 1:
+            raise ValueError("leaf_size must be positive")
+
+        self._leaf_size = leaf_size
+        self._fixed_point = fixed_point
+        self._xs = np.empty(0, dtype=self._coord_type)
+        self._ys = np.empty(0, dtype=self._coord_type)
+        # Id of the data of every point in the side table
+        self._ids = np.empty(0, dtype=np.int64)
+        self._payloads = []
+
+        # Number of nodes visited by the last nearest node search
+        self._visited_nodes = 0
+        # Shared memory block with the arrays of an attached tree
+        self._shared_memory = None
+
+        if init_data is not None:
+            self.rebuild_tree(init_data)
+
+    def __len__(self):
+        return len(self._xs)
+
+    def get_root(self) -> Union[Node, None]:
+        """
+        :return: Root Node of KD tree, created on demand
+        """
+        return self._node(len(self._xs) // 2) if len(self._xs) else None
+
+    @property
+    def fixed_point(self) -> bool:
+        """
+        :return: Whether the coordinates are kept as int32 in 1e-7 degree units
+        """
+        return self._fixed_point
+
+    @property
+    def visited_nodes(self) -> int:
+        """
+        Get the number of nodes visited by the last closest_node call
+        :return: Number of visited nodes
+        """
+        return self._visited_nodes
+
+    def closest_node(self, point: Point) -> Union[Node, None]:
+        """
+        Searches for the nearest node of the point
+        :param point: Pivot point
+        :return: Nearest Point
+        """
+        index = self._closest_index(self._encode(point.x), self._encode(point.y))
+        return self._node(index) if index >= 0 else None
+
+    def check_entry(self, start_point: Point, end_point: Point) -> list:
+        """
+        Outputs a list of nodes that are included in
+        the area from start_point to end_point
+        :param start_point: First point
+        :param end_point: Second point
+        :return: List with nodes
+        """
+        if start_point.x > end_point.x or start_point.y > end_point.y:
+            raise ValueError("First point must be less then second")
+
+        return [self._node(index) for index in self._entry_indices(start_point, end_point)]
+
+    def rebuild_tree(self, init_data: INIT_TREE) -> Union[Node, None]:
+        """
+        Rebuild KD tree by points
+        :param init_data: Tuple with points and data by which to build a tree
+        :return: Root Node of KD-tree
+        """
+        coords = np.array([item[0].points for item in init_data], dtype=np.float64).reshape(len(init_data), 2)
+        if self._fixed_point:
+            coords = to_fixed(coords)
+
+        self._payloads = [item[1] for item in init_data]
+        self._build(coords[:, 0], coords[:, 1], np.arange(len(coords), dtype=np.int64))
+        return self.get_root()
+
+    def save(self, path: str) -> None:
+        """
+        Saves the layout to the file,
+        the data of the points is saved as JSON to the sidecar file path + ".tags"
+        :param path: Path of the file
+        :return: None
+        """
+        save_tree(path, self._layout, [np.column_stack((self._xs, self._ys)), self._ids], self._payloads)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, leaf_size: int = 1) -> "FlatKdTree":
+        """
+        Opens the tree saved by save. With mmap the arrays are not copied,
+        the file pages are read on demand and shared between processes through the page cache,
+        the data of the points is decoded when it is accessed. The fixed point is taken from the file
+        :param path: Path of the file
+        :param mmap: Map the file into memory instead of reading it
+        :param leaf_size: Maximum number of points in a leaf
+        :return: Loaded tree
+        """
+        tree = cls(leaf_size=leaf_size)
+        (coords, tree._ids), tree._payloads = load_tree(path, (LAYOUT_IMPLICIT, LAYOUT_IMPLICIT_FIXED), mmap)
+        tree._set_coords(coords)
+        return tree
+
+    def share(self) -> "SharedMemory":
+        """
+        Copies the tree to a new shared memory block in the layout of save,
+        other processes open it by the block name with attach.
+        The caller owns the block and must close and unlink it when the workers are done
+        :return: Shared memory block
+        """
+        # Shared memory needs Python 3.8, it is imported only when the tree is shared
+        from multiprocessing.shared_memory import SharedMemory
+
+        chunks = dump_tree(self._layout, [np.column_stack((self._xs, self._ys)), self._ids])
+        chunks += dump_payloads(self._payloads)
+        chunks = [np.frombuffer(chunk, dtype=np.uint8) for chunk in chunks]
+
+        block = SharedMemory(create=True, size=sum(len(chunk) for chunk in chunks))
+        memory = np.ndarray(block.size, dtype=np.uint8, buffer=block.buf)
+        position = 0
+        for chunk in chunks:
+            memory[position:position + len(chunk)] = chunk
+            position += len(chunk)
+        del memory
+
+        _PUBLISHED_BLOCKS.add(block.name)
+        weakref.finalize(block, _PUBLISHED_BLOCKS.discard, block.name)
+        return block
+
+    @classmethod
+    def attach(cls, name: str, leaf_size: int = 1) -> "FlatKdTree":
+        """
+        Opens the tree published by share in another process, the arrays are read-only views
+        of the shared memory block, so all processes use one copy. The data of the points is decoded
+        when it is accessed, call close to detach
+        :param name: Name of the shared memory block
+        :param leaf_size: Maximum number of points in a leaf
+        :return: Attached tree
+        """
+        from multiprocessing.shared_memory import SharedMemory
+
+        if sys.version_info >= (3, 13):
+            block = SharedMemory(name=name, track=False)
+        else:
+            block = SharedMemory(name=name)
+            # On POSIX attaching registers the block with the resource tracker, which would unlink it
+            # when the process exits. Only a process that started its own tracker drops the registration:
+            # the tracker of the publisher is shared with its child processes and must keep it
+            if os.name == "posix" and multiprocessing.parent_process() is None \
+                    and block.name not in _PUBLISHED_BLOCKS:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(block._name, "shared_memory")
+        tree = cls(leaf_size=leaf_size)
+
+        (coords, tree._ids), end = parse_tree(block.buf, (LAYOUT_IMPLICIT, LAYOUT_IMPLICIT_FIXED))
+        tree._set_coords(coords)
+        tree._payloads = parse_payloads(block.buf, end)
+        tree._shared_memory = block
+
+        return tree
+
+    def close(self) -> None:
+        """
+        Detaches the tree from the shared memory block, the tree is empty afterwards.
+        The nodes returned before stay valid
+        :return: None
+        """
+        self._xs = np.empty(0, dtype=self._coord_type)
+        self._ys = np.empty(0, dtype=self._coord_type)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._payloads = []
+
+        if self._shared_memory is not None:
+            self._shared_memory.close()
+            self._shared_memory = None
+
+    @property
+    def _coord_type(self) -> np.dtype:
+        """
+        :return: Dtype of the coordinate arrays
+        """
+        return FIXED_TYPE if self._fixed_point else np.dtype(np.float64)
+
+    @property
+    def _layout(self) -> int:
+        """
+        :return: Storage layout of the tree
+        """
+        return LAYOUT_IMPLICIT_FIXED if self._fixed_point else LAYOUT_IMPLICIT
+
+    def _set_coords(self, coords: np.ndarray) -> None:
+        """
+        Sets the coordinate arrays read from the storage, the fixed point follows their dtype
+        :param coords: Array (n, 2) of the coordinates in the layout
+        :return: None
+        """
+        self._fixed_point = coords.dtype.kind == "i"
+        self._xs = coords[:, 0]
+        self._ys = coords[:, 1]
+
+    def _encode(self, value: float) -> Union[float, int]:
+        """
+        Converts a coordinate given to the tree to the units of the arrays,
+        the fixed-point units are compared with the arrays as integers
+        :param value: Coordinate
+        :return: Coordinate in the units of the arrays
+        """
+        return int(np.rint(value * SCALE)) if self._fixed_point else value
+
+    def _build(self, xs: np.ndarray, ys: np.ndarray, ids: np.ndarray) -> None:
+        """
+        Places the points into the balanced layout
+        :param xs: X coordinates of the points
+        :param ys: Y coordinates of the points
+        :param ids: Data ids of the points
+        :return: None
+        """
+        order = np.empty(len(xs), dtype=np.int64)
+        # Start of the range of every subtree of the previous level and the position of its root
+        range_start = np.zeros(1, dtype=np.int64)
+        root_position = np.zeros(1, dtype=np.int64)
+
+        for medians, _, left_sizes, parents, left_flags, _ in split_levels(xs, ys):
+            range_start = np.where(left_flags, range_start[parents], root_position[parents] + 1)
+            root_position = range_start + left_sizes
+            order[root_position] = medians
+
+        self._xs = np.ascontiguousarray(xs, dtype=self._coord_type)[order]
+        self._ys = np.ascontiguousarray(ys, dtype=self._coord_type)[order]
+        self._ids = np.asarray(ids, dtype=np.int64)[order]
+
+    def _node(self, index: int) -> Node:
+        """
+        Creates a node for the point in the layout
+        :param index: Position of the point in the layout
+        :return: Node with the point and its data
+        """
+        x, y = self._xs[index].item(), self._ys[index].item()
+        if self._fixed_point:
+            # The same division as from_fixed without creating arrays
+            x, y = x / SCALE, y / SCALE
+        return Node(Point(float(x), float(y)), data=self._payloads[self._ids[index]])
+
+    def _distance(self, x_1: float, y_1: float, x_2: float, y_2: float) -> float:
+        """
+        Calculate euclidean distance by 2 points
+        :param x_1: X of the first point
+        :param y_1: Y of the first point
+        :param x_2: X of the second point
+        :param y_2: Y of the second point
+        :return: Euclidean distance
+        """
+        return math.hypot(x_1 - x_2, y_1 - y_2)
+
+    def _axis_distance(self, x: float, y: float, node_x: float, node_y: float, axis: int) -> float:
+        """
+        Calculate the lower bound of the distance from the point to any point
+        on the other side of the node splitting plane, in the units of _distance
+        :param x: X of the pivot
+        :param y: Y of the pivot
+        :param node_x: X of the node
+        :param node_y: Y of the node
+        :param axis: Splitting axis of the node
+        :return: Distance to the splitting plane
+        """
+        return abs(x - node_x) if axis == 0 else abs(y - node_y)
+
+    def _leaf_distance(self, x: float, y: float, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """
+        Vectorized _distance from the pivot to the points of a leaf
+        :param x: X of the pivot
+        :param y: Y of the pivot
+        :param xs: X coordinates of the leaf points
+        :param ys: Y coordinates of the leaf points
+        :return: Array of euclidean distances
+        """
+        return np.hypot(xs - x, ys - y)
+
+    def _closest_index(self, x: float, y: float) -> int:
+        """
+        Calculate the position of the closest point to pivot
+        :param x: X of the pivot
+        :param y: Y of the pivot
+        :return: Position in the layout or -1 for an empty tree
+        """
+        self._visited_nodes = 0
+        # A single point is checked faster without numpy
+        leaf_size = self._leaf_size if self._leaf_size > 1 else 0
+        xs = memoryview(self._xs)
+        ys = memoryview(self._ys)
+        pivot = (x, y)
+
+        best = -1
+        best_distance = math.inf
+
+        # Leaves are checked together in one numpy call, except the first one,
+        # which is the leaf of the pivot and gives the bound to prune the rest
+        leaves = []
+        first_leaf = True
+
+        # (start, end, depth, lower bound of the distance to the subtree)
+        stack = [(0, len(xs), 0, 0.0)] if len(xs) else []
+
+        while stack:
+            start, end, depth, bound = stack.pop()
+            if bound >= best_distance:
+                continue
+
+            if end - start <= leaf_size:
+                leaves.append((start, end))
+                if first_leaf:
+                    best, best_distance = self._closest_in_leaves(x, y, leaves, best, best_distance)
+                    leaves = []
+                    first_leaf = False
+                continue
+
+            self._visited_nodes += 1
+            middle = (start + end) // 2
+            node_x = xs[middle]
+            node_y = ys[middle]
+
+            distance = self._distance(x, y, node_x, node_y)
+            if distance < best_distance:
+                best, best_distance = middle, distance
+
+            axis = depth % self.DIMENSION
+            left = (start, middle, depth + 1)
+            right = (middle + 1, end, depth + 1)
+
+            if pivot[axis] < (node_x, node_y)[axis]:
+                next_branch, opposite_branch = left, right
+            else:
+                next_branch, opposite_branch = right, left
+
+            if opposite_branch[0] < opposite_branch[1]:
+                plane = self._axis_distance(x, y, node_x, node_y, axis)
+                stack.append(opposite_branch + (max(bound, plane),))
+            if next_branch[0] < next_branch[1]:
+                stack.append(next_branch + (bound,))
+
+        if leaves:
+            best, best_distance = self._closest_in_leaves(x, y, leaves, best, best_distance)
+
+        return best
+
+    def _closest_in_leaves(self, x: float, y: float, leaves: List[Tuple[int, int]], best: int,
+                           best_distance: float) -> Tuple[int, float]:
+        """
+        Checks the points of the leaves with one vectorized distance calculation
+        :param x: X of the pivot
+        :param y: Y of the pivot
+        :param leaves: (start, end) ranges of the leaves
+        :param best: Position of the best point found so far
+        :param best_distance: Distance to the best point
+        :return: Position of the best point and the distance to it
+        """
+        indices = self._leaf_indices(leaves)
+        self._visited_nodes += len(indices)
+
+        # With the fixed point int32 differences could overflow, the float pivot makes them float
+        distances = self._leaf_distance(float(x), float(y), self._xs[indices], self._ys[indices])
+        leaf_best = int(distances.argmin())
+
+        if distances[leaf_best] < best_distance:
+            return int(indices[leaf_best]), float(distances[leaf_best])
+        return best, best_distance
+
+    @staticmethod
+    def _leaf_indices(leaves: List[Tuple[int, int]]) -> np.ndarray:
+        """
+        Joins the ranges of the leaves into one array of positions
+        :param leaves: (start, end) ranges of the leaves
+        :return: Positions of all points of the leaves
+        """
+        if len(leaves) == 1:
+            return np.arange(leaves[0][0], leaves[0][1])
+
+        bounds = np.array(leaves, dtype=np.int64)
+        lengths = bounds[:, 1] - bounds[:, 0]
+        # Every position is its number in the joined array plus the shift of its leaf
+        shifts = np.repeat(bounds[:, 0] - (np.cumsum(lengths) - lengths), lengths)
+        return shifts + np.arange(lengths.sum())
+
+    def _entry_indices(self, start_pos: Point, end_pos: Point) -> List[int]:
+        """
+        Collects the positions of the points in the area,
+        skipping the subtrees which lie on the other side of the splitting plane
+        :param start_pos: Start area position
+        :param end_pos: End area position
+        :return: Positions in the layout
+        """
+        # A single point is checked faster without numpy
+        leaf_size = self._leaf_size if self._leaf_size > 1 else 0
+        xs = memoryview(self._xs)
+        ys = memoryview(self._ys)
+        low = tuple(self._encode(value) for value in start_pos.points)
+        high = tuple(self._encode(value) for value in end_pos.points)
+        if self._fixed_point:
+            # numpy compares int32 arrays only with values of the int32 range, clipping keeps the result
+            int32 = np.iinfo(np.int32)
+            low = tuple(min(max(value, int32.min), int32.max) for value in low)
+            high = tuple(min(max(value, int32.min), int32.max) for value in high)
+
+        found = []
+        # Leaves are checked together in one numpy call after the traversal
+        leaves = []
+        stack = [(0, len(xs), 0)] if len(xs) else []
+
+        while stack:
+            start, end, depth = stack.pop()
+
+            if end - start <= leaf_size:
+                leaves.append((start, end))
+                continue
+
+            middle = (start + end) // 2
+            axis = depth % self.DIMENSION
+            node = (xs[middle], ys[middle])
+
+            search_left = node[axis] >= low[axis]
+            search_right = node[axis] <= high[axis]
+
+            if search_left and search_right and low[1 - axis] <= node[1 - axis] <= high[1 - axis]:
+                found.append(middle)
+
+            # Right is pushed first, so the left subtree is visited first
+            if search_right and middle + 1 < end:
+                stack.append((middle + 1, end, depth + 1))
+            if search_left and start < middle:
+                stack.append((start, middle, depth + 1))
+
+        if leaves:
+            indices = self._leaf_indices(leaves)
+            leaf_xs = self._xs[indices]
+            leaf_ys = self._ys[indices]
+            inside = (leaf_xs >= low[0]) & (leaf_xs <= high[0]) & (leaf_ys >= low[1]) & (leaf_ys <= high[1])
+            found.extend(indices[inside].tolist())
+
+        return found
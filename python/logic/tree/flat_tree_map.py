@@ -0,0 +1,115 @@
+"""
+The module implements a class derived from the flat KD tree
+and overrides distance calculation methods
+"""
+
+# Standard library import
+import math
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+from ..fixed_point import SCALE
+from .flat_tree import FlatKdTree
+from .tree_map import KdTreeMap
+
+
+class FlatKdTreeMap(FlatKdTree):
+    """
+    The class inherits from the flat KD tree and measures the distance on the sphere in metres,
+    as KdTreeMap does, so the points are latitude and longitude and the nearest object
+    is the same as in KdTreeMap. The tree is shared between processes in the same way as FlatKdTree
+    """
+
+    EARTH_RADIUS = KdTreeMap.EARTH_RADIUS
+    PI = math.pi
+
+    def _radians(self, value):
+        """
+        Converts a coordinate in the units of the arrays to radians
+        :param value: Coordinate or array of coordinates
+        :return: Radians
+        """
+        return value * (self.PI / 180 / SCALE if self._fixed_point else self.PI / 180)
+
+    def _distance(self, x_1: float, y_1: float, x_2: float, y_2: float) -> float:
+        """
+        Calculates the distance between two points on the sphere
+        :param x_1: Latitude of the first point
+        :param y_1: Longitude of the first point
+        :param x_2: Latitude of the second point
+        :param y_2: Longitude of the second point
+        :return: Distance between points in metres
+        """
+        lat_1, lat_2 = self._radians(x_1), self._radians(x_2)
+        delta = self._radians(y_2 - y_1)
+
+        cl1, sl1 = math.cos(lat_1), math.sin(lat_1)
+        cl2, sl2 = math.cos(lat_2), math.sin(lat_2)
+        cos_delta = math.cos(delta)
+
+        y = math.hypot(cl2 * math.sin(delta), cl1 * sl2 - sl1 * cl2 * cos_delta)
+        x = sl1 * sl2 + cl1 * cl2 * cos_delta
+
+        return math.atan2(y, x) * self.EARTH_RADIUS
+
+    def _axis_distance(self, x: float, y: float, node_x: float, node_y: float, axis: int) -> float:
+        """
+        Calculates the lower bound of the distance on the sphere from the pivot
+        to any point on the other side of the node splitting plane.
+        Latitude plane - the distance along the meridian, longitude plane - the distance
+        to the node meridian or to the antimeridian, whichever is closer
+        :param x: Latitude of the pivot
+        :param y: Longitude of the pivot
+        :param node_x: Latitude of the node
+        :param node_y: Longitude of the node
+        :param axis: Splitting axis of the node (0 - latitude, 1 - longitude)
+        :return: Distance to the splitting plane in metres
+        """
+        if axis == 0:
+            return abs(self._radians(x - node_x)) * self.EARTH_RADIUS
+
+        lat = self._radians(x)
+        lon = self._radians(y)
+        delta = abs(lon - self._radians(node_y))
+        antimeridian_delta = self.PI - abs(lon)
+
+        return min(self._meridian_distance(lat, delta), self._meridian_distance(lat, antimeridian_delta))
+
+    def _meridian_distance(self, lat: float, delta: float) -> float:
+        """
+        Calculates the distance on the sphere from a point to a meridian (pole to pole)
+        :param lat: Latitude of the point in radians
+        :param delta: Longitude difference between the point and the meridian in radians
+        :return: Distance to the meridian in metres
+        """
+        delta = min(delta, 2 * self.PI - delta)
+
+        # Behind a right angle the closest point of the meridian is the pole
+        if delta >= self.PI / 2:
+            return (self.PI / 2 - abs(lat)) * self.EARTH_RADIUS
+
+        return math.asin(min(1.0, math.cos(lat) * math.sin(delta))) * self.EARTH_RADIUS
+
+    def _leaf_distance(self, x: float, y: float, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """
+        Vectorized _distance from the pivot to the points of a leaf
+        :param x: Latitude of the pivot
+        :param y: Longitude of the pivot
+        :param xs: Latitudes of the leaf points
+        :param ys: Longitudes of the leaf points
+        :return: Array of distances in metres
+        """
+        lat_1 = self._radians(x)
+        lat_2 = self._radians(xs)
+        delta = self._radians(ys - y)
+
+        cl1, sl1 = math.cos(lat_1), math.sin(lat_1)
+        cl2, sl2 = np.cos(lat_2), np.sin(lat_2)
+        cos_delta = np.cos(delta)
+
+        y = np.hypot(cl2 * np.sin(delta), cl1 * sl2 - sl1 * cl2 * cos_delta)
+        x = sl1 * sl2 + cl1 * cl2 * cos_delta
+
+        return np.arctan2(y, x) * self.EARTH_RADIUS
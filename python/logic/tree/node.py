@@ -11,6 +11,8 @@ class Node:
     Class implementing the Node of k-d tree
     """
 
+    __slots__ = ("_point", "_left_child", "_right_child", "_data", "_size", "_bounds", "_cache")
+
     def __init__(self, init_point: Point, data=None):
         """
         Initializing a KD tree node
@@ -21,6 +23,12 @@ class Node:
         self._left_child = None
         self._right_child = None
         self._data = data
+        # Number of nodes in the subtree of this node
+        self._size = 1
+        # Bounding box of the subtree of this node (min_x, min_y, max_x, max_y)
+        self._bounds = (init_point.x, init_point.y, init_point.x, init_point.y)
+        # Values calculated by the tree from the point, reset when the point changes
+        self._cache = None
 
     def __str__(self):
         return f"Node - {self._point}"
@@ -75,6 +83,7 @@ class Node:
         :return: None
         """
         self._point = point
+        self._cache = None
 
     @property
     def data(self):
@@ -92,3 +101,54 @@ class Node:
         :return: None
         """
         self._data = value
+
+    @property
+    def size(self) -> int:
+        """
+        Get the number of nodes in the subtree of the node
+        :return: Subtree size
+        """
+        return self._size
+
+    @size.setter
+    def size(self, value: int):
+        """
+        Set the number of nodes in the subtree of the node
+        :param value: Subtree size
+        :return: None
+        """
+        self._size = value
+
+    @property
+    def bounds(self) -> tuple:
+        """
+        Get the bounding box of the subtree of the node
+        :return: (min_x, min_y, max_x, max_y)
+        """
+        return self._bounds
+
+    @bounds.setter
+    def bounds(self, value: tuple):
+        """
+        Set the bounding box of the subtree of the node
+        :param value: (min_x, min_y, max_x, max_y)
+        :return: None
+        """
+        self._bounds = value
+
+    @property
+    def cache(self):
+        """
+        Get the values calculated by the tree from the node point
+        :return: Cached values or None
+        """
+        return self._cache
+
+    @cache.setter
+    def cache(self, value):
+        """
+        Set the values calculated by the tree from the node point
+        :param value: Values to cache
+        :return: None
+        """
+        self._cache = value
@@ -0,0 +1,241 @@
+"""
+Module implementing the binary layout in which the trees are saved to files or shared memory.
+The tree starts with a header followed by flat little-endian arrays,
+so they can be used from a mapped file or a shared memory block without copying.
+The data of the points is kept in the sidecar next to it and is decoded from JSON only when accessed
+"""
+
+# Standard library import
+import json
+import mmap as memory_map
+import struct
+from typing import List, Tuple, Union
+
+# Third party imports
+import numpy as np
+
+MAGIC = b"KDTREE\x00\x00"
+TAGS_MAGIC = b"KDTAGS\x00\x00"
+VERSION = 1
+
+# Order of the points in the file
+LAYOUT_LINKED = 0  # Pre-order with child indices (KdTree)
+LAYOUT_IMPLICIT = 1  # Balanced layout, the root of [lo, hi) in the middle, no child indices (FlatKdTree)
+LAYOUT_IMPLICIT_FIXED = 2  # LAYOUT_IMPLICIT with int32 coordinates in 1e-7 degree units
+
+COORD_TYPE = np.dtype("<f8")
+INDEX_TYPE = np.dtype("<i8")
+FIXED_COORD_TYPE = np.dtype("<i4")
+
+# Arrays of every layout in the order of the file: (dtype, number of columns), every array has a row per point
+BLOCKS = {
+    # Coordinates, child indices (-1 for no child), subtree sizes, subtree bounding boxes, ids of the point data
+    LAYOUT_LINKED: ((COORD_TYPE, 2), (INDEX_TYPE, 2), (INDEX_TYPE, 1), (COORD_TYPE, 4), (INDEX_TYPE, 1)),
+    # Coordinates, ids of the point data
+    LAYOUT_IMPLICIT: ((COORD_TYPE, 2), (INDEX_TYPE, 1)),
+    LAYOUT_IMPLICIT_FIXED: ((FIXED_COORD_TYPE, 2), (INDEX_TYPE, 1)),
+}
+
+# Magic, version, layout (0 in the sidecar), number of records
+HEADER = struct.Struct("<8sIIQ")
+
+
+def tags_path(path: str) -> str:
+    """
+    Get the path of the sidecar file with the data of the points
+    :param path: Path of the tree file
+    :return: Path of the sidecar file
+    """
+    return f"{path}.tags"
+
+
+def save_tree(path: str, layout: int, arrays: List[np.ndarray], payloads) -> None:
+    """
+    Writes the tree file and its sidecar file
+    :param path: Path of the tree file
+    :param layout: One of the layouts of BLOCKS
+    :param arrays: Arrays of the layout in the order of BLOCKS
+    :param payloads: Sequence of JSON serializable data of the points
+    :return: None
+    """
+    for file_path, chunks in ((path, dump_tree(layout, arrays)), (tags_path(path), dump_payloads(payloads))):
+        with open(file_path, "wb") as file:
+            for chunk in chunks:
+                file.write(chunk)
+
+
+def load_tree(path: str, layout: Union[int, Tuple[int, ...]],
+              mmap: bool = True) -> Tuple[List[np.ndarray], "PayloadTable"]:
+    """
+    Reads the tree file saved by save_tree
+    :param path: Path of the tree file
+    :param layout: Expected layout of the file or a tuple of the accepted layouts
+    :param mmap: Map the files into memory instead of reading them
+    :return: Arrays of the layout in the order of BLOCKS (one column arrays are flat) and the data table
+    """
+    buffer = _open_buffer(path, mmap)
+    arrays, end = parse_tree(buffer, layout)
+    if end != len(buffer):
+        raise ValueError("The file is damaged")
+
+    return arrays, parse_payloads(_open_buffer(tags_path(path), mmap))
+
+
+def dump_tree(layout: int, arrays: List[np.ndarray]) -> list:
+    """
+    Get the binary chunks of the tree: the header and the arrays
+    :param layout: One of the layouts of BLOCKS
+    :param arrays: Arrays of the layout in the order of BLOCKS
+    :return: List of bytes-like chunks
+    """
+    count = len(arrays[0])
+    chunks = [HEADER.pack(MAGIC, VERSION, layout, count)]
+
+    for array, (dtype, columns) in zip(arrays, BLOCKS[layout]):
+        chunks.append(np.ascontiguousarray(array, dtype=dtype).reshape(count, columns))
+
+    return chunks
+
+
+def dump_payloads(payloads) -> list:
+    """
+    Get the binary chunks of the sidecar: the header, the offsets of the records
+    and the JSON records, each followed by a comma
+    :param payloads: Sequence of JSON serializable data of the points
+    :return: List of bytes-like chunks
+    """
+    records = [json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"," for payload in payloads]
+    offsets = np.zeros(len(records) + 1, dtype=INDEX_TYPE)
+    np.cumsum([len(record) for record in records], out=offsets[1:])
+
+    return [HEADER.pack(TAGS_MAGIC, VERSION, 0, len(records)), offsets, b"".join(records)]
+
+
+def parse_tree(buffer, layout: Union[int, Tuple[int, ...]], start: int = 0) -> Tuple[List[np.ndarray], int]:
+    """
+    Creates read-only views of the tree arrays in the buffer
+    :param buffer: Bytes-like object with the chunks of dump_tree
+    :param layout: Expected layout of the tree or a tuple of the accepted layouts,
+    the accepted layouts are told apart by the dtypes of the arrays
+    :param start: Position of the tree in the buffer
+    :return: Arrays of the layout in the order of BLOCKS (one column arrays are flat) and the end of the tree
+    """
+    file_layout, count = _parse_header(buffer, start, MAGIC)
+    if file_layout not in (layout if isinstance(layout, tuple) else (layout,)):
+        raise ValueError("The file holds a tree of another layout")
+
+    shapes = [(dtype, (count, columns) if columns > 1 else (count,)) for dtype, columns in BLOCKS[file_layout]]
+    return _parse_blocks(buffer, shapes, start + HEADER.size)
+
+
+def parse_payloads(buffer, start: int = 0) -> "PayloadTable":
+    """
+    Creates the data table over the sidecar chunks in the buffer
+    :param buffer: Bytes-like object with the chunks of dump_payloads
+    :param start: Position of the sidecar in the buffer
+    :return: Data table
+    """
+    _, count = _parse_header(buffer, start, TAGS_MAGIC)
+    (offsets,), blob_start = _parse_blocks(buffer, [(INDEX_TYPE, (count + 1,))], start + HEADER.size)
+    (blob,), _ = _parse_blocks(buffer, [(np.dtype("u1"), (int(offsets[-1]),))], blob_start)
+
+    return PayloadTable(offsets, blob)
+
+
+class PayloadTable:
+    """
+    Read-only sequence of the point data in the sidecar layout,
+    every record is decoded when it is accessed for the first time
+    """
+
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray):
+        """
+        :param offsets: Start of every record in the blob and the end of the blob
+        :param blob: JSON records, each followed by a comma
+        """
+        # Memory views are indexed without creating numpy objects
+        self._offsets = memoryview(offsets)
+        self._blob = memoryview(blob)
+        self._decoded = {}
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int):
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Payload index out of range")
+
+        if index not in self._decoded:
+            # The record is followed by a comma
+            self._decoded[index] = json.loads(bytes(self._blob[self._offsets[index]:self._offsets[index + 1] - 1]))
+        return self._decoded[index]
+
+    def decode_all(self) -> list:
+        """
+        Decodes all records at once, faster than accessing them one by one
+        :return: List with the data of all points
+        """
+        if not len(self):
+            return []
+        return json.loads(b"[" + bytes(self._blob[:-1]) + b"]")
+
+
+def _open_buffer(path: str, mmap: bool):
+    """
+    Maps or reads the whole file
+    :param path: Path of the file
+    :param mmap: Map the file into memory instead of reading it
+    :return: Bytes-like object with the content of the file
+    """
+    with open(path, "rb") as file:
+        if mmap:
+            # The mapping stays valid after the file is closed
+            return memory_map.mmap(file.fileno(), 0, access=memory_map.ACCESS_READ)
+        return file.read()
+
+
+def _parse_header(buffer, start: int, magic: bytes) -> Tuple[int, int]:
+    """
+    Reads and checks the header
+    :param buffer: Bytes-like object
+    :param start: Position of the header
+    :param magic: Expected magic bytes
+    :return: Layout and number of records
+    """
+    if len(buffer) < start + HEADER.size:
+        raise ValueError("The file is damaged")
+
+    file_magic, version, layout, count = HEADER.unpack_from(buffer, start)
+    if file_magic != magic:
+        raise ValueError("The file is not a saved tree")
+    if version > VERSION:
+        raise ValueError(f"Unsupported file version {version}")
+
+    return layout, count
+
+
+def _parse_blocks(buffer, blocks: list, start: int) -> Tuple[List[np.ndarray], int]:
+    """
+    Creates read-only views of the arrays which follow each other from the start position
+    :param buffer: Bytes-like object
+    :param blocks: (dtype, shape) of every array
+    :param start: Position of the first array
+    :return: List of arrays and the end of the last one
+    """
+    arrays = []
+    offset = start
+
+    for dtype, shape in blocks:
+        size = int(np.prod(shape))
+        if len(buffer) < offset + dtype.itemsize * size:
+            raise ValueError("The file is damaged")
+
+        array = np.frombuffer(buffer, dtype=dtype, count=size, offset=offset).reshape(shape)
+        array.flags.writeable = False
+        arrays.append(array)
+        offset += dtype.itemsize * size
+
+    return arrays, offset
@@ -3,11 +3,18 @@ Module implementing the k-d tree
 """
 
 # Standard library import
-from typing import Union, Tuple, List
+import heapq
+import math
+from typing import Union, Tuple, List, Iterator
+
+# Third party imports
+import numpy as np
 
 # Local application imports
 from ..point import Point
 from .node import Node
+from .build import tree_levels
+from .storage import LAYOUT_LINKED, save_tree, load_tree
 
 
 class KdTree:
@@ -19,12 +26,24 @@ class KdTree:
     # Since this tree was built for the map, the space is two-dimensional
     DIMENSION = 2
 
+    # A subtree is rebuilt when one of its children holds more than this share of its nodes
+    BALANCE_FACTOR = 0.75
+
+    # Smaller subtrees are built by plain sorting, there numpy costs more than the work itself
+    SMALL_BUILD_SIZE = 64
+
     def __init__(self, init_data: INIT_TREE = None):
         """
         Builds a k-d tree based on the tuple of Points and Data
         :param init_data: Tuple with points and data by which to build a tree
         """
         self._output_str = ""
+        # Number of nodes visited by the last nearest node search
+        self._visited_nodes = 0
+        # Guaranteed approximation ratio of the last closest_node call
+        self._error_bound = 1.0
+        # Arrays with the tree structure for batch queries, built on demand
+        self._flat_tree = None
 
         # Build tree if init nodes is not None
         self._root_node = self._build_tree(self.unpack(init_data)) if init_data is not None else None
@@ -40,6 +59,32 @@ class KdTree:
         """
         return self._root_node
 
+    def get_nodes(self) -> List[Node]:
+        """
+        Get the tree nodes in pre-order,
+        the indices returned by batch queries refer to this list
+        :return: List with nodes
+        """
+        return self._get_flat_tree()[0]
+
+    @property
+    def visited_nodes(self) -> int:
+        """
+        Get the number of nodes visited by the last closest_node call
+        :return: Number of visited nodes
+        """
+        return self._visited_nodes
+
+    @property
+    def error_bound(self) -> float:
+        """
+        Get the approximation ratio achieved by the last closest_node call:
+        the distance to the found node is at most error_bound times the distance to the true nearest one,
+        1.0 means the found node is exact
+        :return: Error bound
+        """
+        return self._error_bound
+
     def insert(self, point: Point, data: dict = None) -> None:
         """
         Insert node with Point coordinates into k-d tree
@@ -47,9 +92,12 @@ class KdTree:
         :param data: Data to set by the node
         :return: None
         """
+        self._flat_tree = None
         node = Node(point, data=data)
         if self._root_node:
-            self._add(node, self._root_node)
+            path = []
+            self._add(node, self._root_node, path=path)
+            self._rebalance(path)
         else:
             self._root_node = node
 
@@ -59,6 +107,7 @@ class KdTree:
         :param point: Point to delete
         :return: None
         """
+        self._flat_tree = None
         node = Node(point)
         if node is None or self._root_node is None:
             return
@@ -66,15 +115,142 @@ class KdTree:
                 self._root_node.point:
             self._root_node = None
         else:
-            self._del(node, self._root_node)
+            path = []
+            self._del(node, self._root_node, path=path)
+            self._rebalance(path)
 
-    def closest_node(self, point: Point) -> Union[Node, None]:
+    def closest_node(self, point: Point, epsilon: float = 0.0, max_visited: int = None) -> Union[Node, None]:
         """
-        Searches for the nearest node of the point
+        Searches for the nearest node of the point.
+        With epsilon the search is (1 + epsilon)-approximate: branches that cannot be
+        more than 1 + epsilon times closer than the best node are skipped.
+        With max_visited the search stops after visiting that many nodes.
+        The achieved approximation ratio is available in error_bound
         :param point: Pivot point
+        :param epsilon: Allowed relative error, 0 for the exact search
+        :param max_visited: Maximum number of nodes to visit, None for no limit
         :return: Nearest Point
         """
-        return self._closest_node(self._root_node, point)
+        if epsilon < 0:
+            raise ValueError("epsilon must not be negative")
+        if max_visited is not None and max_visited <= 0:
+            raise ValueError("max_visited must be positive")
+
+        self._visited_nodes = 0
+        return self._closest_node(self._root_node, point, epsilon, max_visited)
+
+    def closest_nodes_batch(self, points) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Searches for the nearest node of every pivot at once.
+        All pivots descend the tree together, first straight to their leaves
+        to get an upper bound, then through every branch the bound does not prune
+        :param points: Array-like of pivots with shape (n, 2)
+        :return: Indices of the nearest nodes in get_nodes() (-1 for an empty tree) and distances to them
+        """
+        pivots = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        nodes, coords, children, axes = self._get_flat_tree()
+
+        best_index = np.full(len(pivots), -1, dtype=np.int64)
+        best_distance = np.full(len(pivots), np.inf)
+
+        if not nodes or not len(pivots):
+            return best_index, best_distance
+
+        # Active (pivot, node) pairs with the lower bound of the distance to the node subtree
+        pivot_ids = np.arange(len(pivots))
+        node_ids = np.zeros(len(pivots), dtype=np.int64)
+        bounds = np.zeros(len(pivots))
+
+        for only_near in (True, False):
+            while len(pivot_ids):
+                distance = self._batch_distance(pivots[pivot_ids], coords[node_ids])
+                improved = distance < best_distance[pivot_ids]
+                np.minimum.at(best_distance, pivot_ids[improved], distance[improved])
+                best = improved & (distance == best_distance[pivot_ids])
+                best_index[pivot_ids[best]] = node_ids[best]
+
+                axis = axes[node_ids]
+                go_right = (pivots[pivot_ids, axis] >= coords[node_ids, axis]).astype(np.int64)
+                near = children[node_ids, go_right]
+
+                if only_near:
+                    keep = near >= 0
+                    pivot_ids, node_ids = pivot_ids[keep], near[keep]
+                    continue
+
+                far = children[node_ids, 1 - go_right]
+                far_bounds = np.maximum(bounds, self._batch_axis_distance(pivots[pivot_ids], coords[node_ids], axis))
+
+                pivot_ids = np.concatenate((pivot_ids, pivot_ids))
+                node_ids = np.concatenate((near, far))
+                bounds = np.concatenate((bounds, far_bounds))
+
+                keep = (node_ids >= 0) & (bounds < best_distance[pivot_ids])
+                pivot_ids, node_ids, bounds = pivot_ids[keep], node_ids[keep], bounds[keep]
+
+            # The second pass starts from the root again, now with the bounds from the first one
+            pivot_ids = np.arange(len(pivots))
+            node_ids = np.zeros(len(pivots), dtype=np.int64)
+            bounds = np.zeros(len(pivots))
+
+        return best_index, self._from_search_distance(best_distance)
+
+    def k_closest_nodes(self, point: Point, k: int, max_distance: float = None) -> List[Node]:
+        """
+        Searches for the k nearest nodes of the point
+        :param point: Pivot point
+        :param k: How many nodes to find
+        :param max_distance: If not None, nodes further than this distance are skipped
+        :return: List of nodes sorted by distance to the pivot
+        """
+        if k <= 0:
+            raise ValueError("k must be positive")
+
+        self._visited_nodes = 0
+        # Max-heap of the best nodes found so far: (-distance, id, node)
+        best_nodes = []
+        if max_distance is not None:
+            max_distance = self._to_search_distance(max_distance)
+        self._k_closest_nodes(self._root_node, Node(Point(point.x, point.y)), k, max_distance, best_nodes)
+
+        return [node for _, _, node in sorted(best_nodes, reverse=True)]
+
+    def iter_nearest(self, point: Point) -> Iterator[Node]:
+        """
+        Lazily yields all nodes in increasing distance to the point,
+        the work done is proportional to the number of nodes read.
+        The tree must not be changed while the generator is in use
+        :param point: Pivot point
+        :return: Generator of nodes
+        """
+        return self._iter_nearest(self._root_node, Node(Point(point.x, point.y)))
+
+    def within_radius(self, point: Point, radius: float, sort: bool = False) -> List[Node]:
+        """
+        Searches for all nodes not further than radius from the point,
+        the radius is measured by _node_distance (metres for the map tree)
+        :param point: Pivot point
+        :param radius: Search radius
+        :param sort: Sort nodes by distance to the pivot
+        :return: List with nodes
+        """
+        nodes_in_radius = []
+        self._radius_search(self._root_node, Node(Point(point.x, point.y)), self._to_search_distance(radius),
+                            nodes_in_radius)
+
+        if sort:
+            nodes_in_radius.sort(key=lambda item: item[0])
+        return [node for _, node in nodes_in_radius]
+
+    def count_within_radius(self, point: Point, radius: float) -> int:
+        """
+        Counts the nodes not further than radius from the point
+        without collecting them
+        :param point: Pivot point
+        :param radius: Search radius
+        :return: Number of nodes
+        """
+        return self._radius_search(self._root_node, Node(Point(point.x, point.y)), self._to_search_distance(radius))
 
     def check_entry(self, start_point: Point, end_point: Point) -> list:
         """
@@ -86,271 +262,842 @@ class KdTree:
         """
         if start_point.x > end_point.x or start_point.y > end_point.y:
             raise ValueError("First point must be less then second")
-        nodes_in_area = []
-        self._entry_field(start_point, end_point, self._root_node, nodes_in_area)
+        return list(self._entry_field(start_point, end_point, self._root_node))
+
+    def iter_entry(self, start_point: Point, end_point: Point) -> Iterator[Node]:
+        """
+        Lazily yields the nodes that are included in
+        the area from start_point to end_point, in the same order as check_entry.
+        The tree must not be changed while the generator is in use
+        :param start_point: First point
+        :param end_point: Second point
+        :return: Generator of nodes
+        """
+        if start_point.x > end_point.x or start_point.y > end_point.y:
+            raise ValueError("First point must be less then second")
+        return self._entry_field(start_point, end_point, self._root_node)
 
-        # nodes_in_area has been changed !
-        return nodes_in_area
+    def count_in_area(self, start_point: Point, end_point: Point) -> int:
+        """
+        Counts the nodes that are included in
+        the area from start_point to end_point without collecting them
+        :param start_point: First point
+        :param end_point: Second point
+        :return: Number of nodes in the area
+        """
+        if start_point.x > end_point.x or start_point.y > end_point.y:
+            raise ValueError("First point must be less then second")
+        return self._entry_count(start_point, end_point, self._root_node)
 
-    def rebuild_tree(self, init_data: INIT_TREE) -> Union[Node, None]:
+    def rebuild_tree(self, init_data: INIT_TREE, processes: int = 1) -> Union[Node, None]:
         """
         Rebuild KD tree by points
         :param init_data: Tuple with points and data by which to build a tree
+        :param processes: Number of processes splitting the points, the tree is the same for any number
         :return: Root Node of KD-tree
         """
+        self._flat_tree = None
         nodes = self.unpack(init_data)
-        self._root_node = self._build_tree(nodes)
+        self._root_node = self._build_tree(nodes, processes=processes)
+        return self._root_node
+
+    @classmethod
+    def from_arrays(cls, xs, ys, ids=None, processes: int = 1) -> "KdTree":
+        """
+        Builds a k-d tree straight from the coordinate arrays without (Point, data) pairs,
+        the data of every node is its integer payload id
+        :param xs: Array-like of x coordinates
+        :param ys: Array-like of y coordinates
+        :param ids: Array-like of integer payload ids, the positions in the arrays by default
+        :param processes: Number of processes splitting the points, the tree is the same for any number
+        :return: Built tree
+        """
+        tree = cls()
+        tree.rebuild_from_arrays(xs, ys, ids, processes)
+        return tree
+
+    def rebuild_from_arrays(self, xs, ys, ids=None, processes: int = 1) -> Union[Node, None]:
+        """
+        Rebuild KD tree by the coordinate arrays
+        :param xs: Array-like of x coordinates
+        :param ys: Array-like of y coordinates
+        :param ids: Array-like of integer payload ids, the positions in the arrays by default
+        :param processes: Number of processes splitting the points, the tree is the same for any number
+        :return: Root Node of KD-tree
+        """
+        xs = np.ascontiguousarray(xs, dtype=np.float64).ravel()
+        ys = np.ascontiguousarray(ys, dtype=np.float64).ravel()
+        ids = np.arange(len(xs), dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64).ravel()
+
+        if not len(xs) == len(ys) == len(ids):
+            raise ValueError("xs, ys and ids must have the same length")
+
+        self._flat_tree = None
+        self._root_node = self._build_arrays(xs, ys, ids, processes)
         return self._root_node
 
-    def _node_distance(self, node_1: Node, node_2: Node) -> float:
+    def save(self, path: str) -> None:
+        """
+        Saves the tree to the file in pre-order with the child indices,
+        the data of the nodes is saved as JSON to the sidecar file path + ".tags"
+        :param path: Path of the file
+        :return: None
+        """
+        nodes, coords, children, _ = self._get_flat_tree()
+        sizes = [node.size for node in nodes]
+        bounds = np.array([node.bounds for node in nodes], dtype=np.float64).reshape(len(nodes), 4)
+
+        save_tree(path, LAYOUT_LINKED, [coords, children, sizes, bounds, np.arange(len(nodes))],
+                  [node.data for node in nodes])
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "KdTree":
+        """
+        Loads the tree saved by save without rebuilding it,
+        the nodes are created and their data is decoded while loading
+        :param path: Path of the file
+        :param mmap: Map the arrays of the file into memory instead of reading them
+        :return: Loaded tree
+        """
+        tree = cls()
+        tree._load(path, mmap)
+        return tree
+
+    def _load(self, path: str, mmap: bool) -> None:
+        """
+        Links the nodes by the child indices of the file.
+        The arrays of the file serve the batch queries until the tree changes
+        :param path: Path of the file
+        :param mmap: Map the arrays of the file into memory instead of reading them
+        :return: None
+        """
+        (coords, children, sizes, bounds, ids), payloads = load_tree(path, LAYOUT_LINKED, mmap)
+        payloads = payloads.decode_all()
+
+        nodes = [Node(Point(x, y), data=payloads[data_id])
+                 for x, y, data_id in zip(coords[:, 0].tolist(), coords[:, 1].tolist(), ids.tolist())]
+        axes = [0] * len(nodes)
+
+        # In pre-order the children follow their parent, so the axis of the parent is already known
+        for index, node, (left, right), size, box in zip(range(len(nodes)), nodes, children.tolist(),
+                                                         sizes.tolist(), bounds.tolist()):
+            node.size = size
+            node.bounds = tuple(box)
+            if left >= 0:
+                node.left_child = nodes[left]
+                axes[left] = 1 - axes[index]
+            if right >= 0:
+                node.right_child = nodes[right]
+                axes[right] = 1 - axes[index]
+
+        self._root_node = nodes[0] if nodes else None
+        self._flat_tree = (nodes, coords, children, np.array(axes, dtype=np.int64))
+
+    def _node_distance(self, node_1: Node, node_2: Node, limit: float = math.inf) -> float:
         """
         Calculate euclidean distance by 2 points
         :param node_1: First point
         :param node_2: Second point
+        :param limit: If the distance is greater than limit, any value greater than limit may be returned,
+        so that subclasses can reject far points by a cheaper bound
         :return: Euclidean distance
         """
         point_1 = node_1.point
         point_2 = node_2.point
         return point_1.euclidean_distance(point_2)
 
-    def _add(self, node: Node, root: Node, depth=0) -> None:
+    def _axis_distance(self, pivot_node: Node, node: Node, axis: int) -> float:
+        """
+        Calculate the lower bound of the distance from the pivot to any point
+        on the other side of the node splitting plane, in the units of _node_distance
+        :param pivot_node: Node with the pivot point
+        :param node: Node whose plane splits the space
+        :param axis: Splitting axis of the node
+        :return: Distance to the splitting plane
+        """
+        return abs(pivot_node.point[axis] - node.point[axis])
+
+    def _to_search_distance(self, distance: float) -> float:
+        """
+        Convert a distance given by the user to the units of _node_distance,
+        the conversion must keep the order of distances
+        :param distance: Distance in the units of the results
+        :return: Distance in the units of _node_distance
+        """
+        return distance
+
+    def _from_search_distance(self, distance):
+        """
+        Convert a distance in the units of _node_distance back to the units of the results
+        :param distance: Distance or array of distances in the units of _node_distance
+        :return: Distance in the units of the results
+        """
+        return distance
+
+    def _batch_distance(self, pivots: np.ndarray, coords: np.ndarray) -> np.ndarray:
+        """
+        Vectorized _node_distance for pairs of points
+        :param pivots: Array of first points with shape (n, 2)
+        :param coords: Array of second points with shape (n, 2)
+        :return: Array of euclidean distances
+        """
+        return np.hypot(pivots[:, 0] - coords[:, 0], pivots[:, 1] - coords[:, 1])
+
+    def _batch_axis_distance(self, pivots: np.ndarray, coords: np.ndarray, axes: np.ndarray) -> np.ndarray:
+        """
+        Vectorized _axis_distance for pairs of pivots and nodes
+        :param pivots: Array of pivots with shape (n, 2)
+        :param coords: Array of node points with shape (n, 2)
+        :param axes: Splitting axes of the nodes
+        :return: Array of distances to the splitting planes
+        """
+        rows = np.arange(len(axes))
+        return np.abs(pivots[rows, axes] - coords[rows, axes])
+
+    def _get_flat_tree(self) -> Tuple[List[Node], np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get the tree as arrays in pre-order, the arrays are cached until the tree changes
+        :return: Nodes list, coordinates (n, 2), children indices (n, 2) with -1 for no child, splitting axes
+        """
+        if self._flat_tree is not None:
+            return self._flat_tree
+
+        nodes = []
+        children = []
+        axes = []
+        # (node, depth, index of the parent, child slot in parent)
+        stack = [(self._root_node, 0, -1, 0)] if self._root_node is not None else []
+
+        while stack:
+            node, depth, parent, slot = stack.pop()
+            index = len(nodes)
+            if parent >= 0:
+                children[parent][slot] = index
+
+            nodes.append(node)
+            children.append([-1, -1])
+            axes.append(depth % self.DIMENSION)
+
+            if node.right_child is not None:
+                stack.append((node.right_child, depth + 1, index, 1))
+            if node.left_child is not None:
+                stack.append((node.left_child, depth + 1, index, 0))
+
+        coords = np.array([node.point.points for node in nodes], dtype=np.float64).reshape(len(nodes), 2)
+        self._flat_tree = (nodes,
+                           coords,
+                           np.array(children, dtype=np.int64).reshape(len(nodes), 2),
+                           np.array(axes, dtype=np.int64))
+        return self._flat_tree
+
+    def _add(self, node: Node, root: Node, depth=0, path: list = None) -> None:
         """
         Traverses the tree, looking for a place to insert a node, once found, inserts the node
         :param node: Node to be added
         :param root: Root node K-d tree
-        :param depth: Recursive parameter
+        :param depth: Depth of the root node
+        :param path: If not None, collects (node, depth) of the passed nodes from the top down
         :return: None
         """
-        if root is None:
-            return None
-
-        axis = depth % self.DIMENSION
         point = node.point
+        x, y = point.x, point.y
 
-        if point[axis] < root.point[axis]:
-            next_branch = root.left_child
-            if next_branch is None:
-                root.left_child = node
-        else:
-            next_branch = root.right_child
-            if next_branch is None:
-                root.right_child = node
+        while root is not None:
+            root.size += 1
+
+            min_x, min_y, max_x, max_y = root.bounds
+            if not (min_x <= x <= max_x and min_y <= y <= max_y):
+                root.bounds = (min(min_x, x), min(min_y, y), max(max_x, x), max(max_y, y))
 
-        self._add(node, next_branch, depth + 1)
+            if path is not None:
+                path.append((root, depth))
 
-    def _del(self, del_node: Node, curr_root: Node, dimension: int = 0) -> Union[Node, None]:
+            axis = depth % self.DIMENSION
+
+            # Ties on the axis are ordered by the other axis, equal points go to the right
+            if (point[axis], point[1 - axis]) < (root.point[axis], root.point[1 - axis]):
+                if root.left_child is None:
+                    root.left_child = node
+                    return None
+                root = root.left_child
+            else:
+                if root.right_child is None:
+                    root.right_child = node
+                    return None
+                root = root.right_child
+
+            depth += 1
+
+    def _del(self, del_node: Node, curr_root: Node, dimension: int = 0, path: list = None) -> Union[Node, None]:
         """
-        Traverses the tree, looking node for delete, delete it
+        Traverses the tree, looking node for delete, delete it.
+        The found node takes the point of the minimum node of its subtree
+        and that very minimum node is deleted next, until a leaf is unlinked.
+        The points are ordered by (axis, other axis), equal points may be on both sides of a node
         :param del_node: Node to delete
         :param curr_root: Root Node
-        :param dimension: Current dimension - x == 0, y == 1
-        :return: None
+        :param dimension: Depth of the root node, x == 0, y == 1
+        :param path: If not None, collects (node, depth) of the remaining passed nodes from the top down
+        :return: Root of the subtree after deletion
         """
+        target = del_node.point
+        passed = []
+        parent = None
+        node = curr_root
+        depth = dimension
+
+        while node is not None and target != node.point:
+            axis = depth % self.DIMENSION
+            passed.append((node, depth))
+            parent = node
+            if (target[axis], target[1 - axis]) < (node.point[axis], node.point[1 - axis]):
+                node = node.left_child
+            else:
+                node = node.right_child
+            depth += 1
 
-        if curr_root is None:
-            return None
-
-        dimension = dimension % self.DIMENSION
+        if node is None:
+            return curr_root
 
-        if del_node.point == curr_root.point:
+        while node.left_child is not None or node.right_child is not None:
+            axis = depth % self.DIMENSION
+
+            if node.right_child is None:
+                # The left subtree becomes the right one, its minimum takes the place of the node
+                node.right_child = node.left_child
+                node.left_child = None
+
+            minimum_path = self._minimum_path(node.right_child, axis, depth + 1)
+            minimum, minimum_depth = minimum_path[-1]
+            node.point = minimum.point
+            node.data = minimum.data
+
+            passed.append((node, depth))
+            passed.extend(minimum_path[:-1])
+            parent = minimum_path[-2][0] if len(minimum_path) > 1 else node
+            node, depth = minimum, minimum_depth
+
+        # Unlink the leaf and shrink the passed subtrees
+        if parent is None:
+            curr_root = None
+        elif parent.left_child is node:
+            parent.left_child = None
+        else:
+            parent.right_child = None
 
-            if curr_root.right_child is not None:
-                right_min = self._minimum_node(curr_root.right_child, dimension, dimension + 1)
+        # The points of the passed nodes may have changed, so their boxes are rebuilt from the bottom
+        for passed_node, _ in reversed(passed):
+            passed_node.size -= 1
+            passed_node.bounds = self._subtree_bounds(passed_node)
 
-                curr_root.point = right_min.point
-                curr_root.data = right_min.data
-                curr_root.right_child = self._del(right_min, curr_root.right_child, dimension + 1)
+        if path is not None:
+            path.extend(passed)
 
-            elif curr_root.left_child is not None:
-                left_min = self._minimum_node(curr_root.left_child, dimension, dimension + 1)
+        return curr_root
 
-                curr_root.point = left_min.point
-                curr_root.data = left_min.data
+    def _rebalance(self, path: List[Tuple[Node, int]]) -> None:
+        """
+        Finds the highest node on the path which is not balanced
+        and rebuilds its subtree (scapegoat partial rebuild)
+        :param path: (node, depth) pairs from the root down, every node is a child of the previous one
+        :return: None
+        """
+        for position, (node, depth) in enumerate(path):
+            heavier_child = max(self._size(node.left_child), self._size(node.right_child))
+            if heavier_child <= self.BALANCE_FACTOR * node.size:
+                continue
+
+            nodes = self._subtree_nodes(node)
+            for subtree_node in nodes:
+                subtree_node.left_child = None
+                subtree_node.right_child = None
+            new_root = self._build_tree(nodes, depth)
+
+            parent = path[position - 1][0] if position > 0 else None
+            if parent is None:
+                self._root_node = new_root
+            elif parent.left_child is node:
+                parent.left_child = new_root
+            else:
+                parent.right_child = new_root
+            return None
 
-                curr_root.right_child = self._del(left_min, curr_root.left_child, dimension + 1)
-                curr_root.left_child = None
+    @staticmethod
+    def _subtree_nodes(root: Node) -> List[Node]:
+        """
+        Collects all nodes of the subtree in pre-order
+        :param root: Root of the subtree
+        :return: List with nodes
+        """
+        nodes = []
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            if node.right_child is not None:
+                stack.append(node.right_child)
+            if node.left_child is not None:
+                stack.append(node.left_child)
+        return nodes
 
-            else:
-                return None
+    @staticmethod
+    def _iter_subtree(root: Node) -> Iterator[Node]:
+        """
+        Lazily yields all nodes of the subtree in pre-order
+        :param root: Root of the subtree
+        :return: Generator of nodes
+        """
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.right_child is not None:
+                stack.append(node.right_child)
+            if node.left_child is not None:
+                stack.append(node.left_child)
 
-            return curr_root
+    @staticmethod
+    def _subtree_bounds(node: Node) -> tuple:
+        """
+        Calculates the bounding box of the subtree by the node point and the boxes of its children
+        :param node: Root of the subtree
+        :return: (min_x, min_y, max_x, max_y)
+        """
+        min_x = max_x = node.point.x
+        min_y = max_y = node.point.y
 
-        if del_node.point[dimension] < curr_root.point[dimension]:
-            curr_root.left_child = self._del(del_node, curr_root.left_child, dimension + 1)
+        for child in (node.left_child, node.right_child):
+            if child is not None:
+                child_min_x, child_min_y, child_max_x, child_max_y = child.bounds
+                min_x = min(min_x, child_min_x)
+                min_y = min(min_y, child_min_y)
+                max_x = max(max_x, child_max_x)
+                max_y = max(max_y, child_max_y)
 
-        else:
-            curr_root.right_child = self._del(del_node, curr_root.right_child, dimension + 1)
+        return min_x, min_y, max_x, max_y
 
-        return curr_root
+    @staticmethod
+    def _size(node: Union[Node, None]) -> int:
+        """
+        :param node: Node or None
+        :return: Size of the node subtree, 0 for None
+        """
+        return node.size if node is not None else 0
 
-    def _closest_node(self, root: Node, point: Point, depth=0) -> Union[Node, None]:
+    def _closest_node(self, root: Node, point: Point, epsilon: float = 0.0,
+                      max_visited: int = None) -> Union[Node, None]:
         """
-        Calculate the closest node to pivot
+        Calculate the closest node to pivot.
+        The branch with the pivot is visited first, the opposite branch waits on the stack
+        with the distance to the splitting plane and is skipped if it is not closer than the best node
+        divided by 1 + epsilon. The smallest bound of the skipped branches gives the error bound
         :param root: Root node of K-d tree
         :param point: The point to which we are looking for the closest
-        :param depth: Recursive parameter
+        :param epsilon: Allowed relative error
+        :param max_visited: Maximum number of nodes to visit, None for no limit
         :return: Closest Point
         """
+        pivot_node = Node(Point(point.x, point.y))
+        best = None
+        best_distance = math.inf
+        # Lower bound of the distance to the nodes that have not been checked
+        skipped_bound = math.inf
+        # Subtrees not closer than this distance are skipped
+        prune_distance = math.inf
+        scale = 1.0 + epsilon
+
+        # (node, depth, lower bound of the distance to the node subtree)
+        stack = [(root, 0, 0.0)] if root is not None else []
+
+        while stack:
+            if max_visited is not None and self._visited_nodes >= max_visited:
+                skipped_bound = min(skipped_bound, min(bound for _, _, bound in stack))
+                break
+
+            node, depth, bound = stack.pop()
+            if bound >= prune_distance:
+                skipped_bound = min(skipped_bound, bound)
+                continue
+
+            self._visited_nodes += 1
+            distance = self._node_distance(pivot_node, node, best_distance)
+            if distance < best_distance:
+                best, best_distance = node, distance
+                prune_distance = distance
+                if epsilon:
+                    # epsilon is relative to the distance in the units of the results
+                    prune_distance = self._to_search_distance(self._from_search_distance(distance) / scale)
+
+            axis = depth % self.DIMENSION
+
+            if point[axis] < node.point[axis]:
+                next_branch = node.left_child
+                opposite_branch = node.right_child
+            else:
+                next_branch = node.right_child
+                opposite_branch = node.left_child
 
-        if root is None:
-            return None
-
-        axis = depth % self.DIMENSION
+            if opposite_branch is not None:
+                stack.append((opposite_branch, depth + 1, max(bound, self._axis_distance(pivot_node, node, axis))))
+            if next_branch is not None:
+                stack.append((next_branch, depth + 1, bound))
 
-        if point[axis] < root.point[axis]:
-            next_branch = root.left_child
-            opposite_branch = root.right_child
+        nearest_bound = min(best_distance, skipped_bound)
+        if best_distance == nearest_bound:
+            self._error_bound = 1.0
         else:
-            next_branch = root.right_child
-            opposite_branch = root.left_child
-
-        best = self._nearest_node(point,
-                                  self._closest_node(
-                                      next_branch,
-                                      point,
-                                      depth + 1
-                                  ),
-                                  root)
-
-        node_point = Node(Point(point.x, point.y))
-
-        # If distance from pivot to 'best' node bigger than module by distance(perpendicular)
-        # from pivot to space section -> check opposite branch (maybe there is a node closer)
-        if self._node_distance(node_point, best) > abs(point[axis] - root.point[axis]):
-            best = self._nearest_node(point,
-                                      self._closest_node(
-                                          opposite_branch,
-                                          point,
-                                          depth + 1
-                                      ),
-                                      best
-                                      )
+            found_distance = self._from_search_distance(best_distance)
+            nearest_bound = self._from_search_distance(nearest_bound)
+            self._error_bound = float(found_distance / nearest_bound) if nearest_bound > 0 else math.inf
 
         return best
 
-    def _nearest_node(self, pivot: Point, node_1: Union[Node, None], node_2: [Node, None]) -> Union[Node, None]:
+    def _k_closest_nodes(self, root: Node, pivot_node: Node, k: int, max_distance: Union[float, None],
+                         best_nodes: list) -> None:
         """
-        Returns the node that is closer to the pivot
-        :param pivot: The point to which we are looking for the closest
-        :param node_1: First node
-        :param node_2: Second node
-        :return: Nearest node to pivot
+        Collects the k closest nodes to pivot into the bounded max-heap
+        :param root: Root node of K-d tree
+        :param pivot_node: Node with the point to which we are looking for the closest
+        :param k: Heap size limit
+        :param max_distance: Maximum distance of a node to be collected, None for no limit
+        :param best_nodes: Max-heap with the best nodes found so far
+        :return: None
         """
-        if node_1 is None:
-            return node_2
+        point = pivot_node.point
 
-        if node_2 is None:
-            return node_1
+        # (node, depth, lower bound of the distance to the node subtree)
+        stack = [(root, 0, 0.0)] if root is not None else []
 
-        pivot_node = Node(Point(pivot.x, pivot.y))
+        while stack:
+            node, depth, bound = stack.pop()
 
-        distance_1 = self._node_distance(pivot_node, node_1)
-        distance_2 = self._node_distance(pivot_node, node_2)
+            # Search radius - distance to the worst of the k nodes, or the distance limit while the heap is not full
+            radius = -best_nodes[0][0] if len(best_nodes) == k else max_distance
+            if radius is not None and bound > radius:
+                continue
 
-        if distance_1 < distance_2:
-            return node_1
-        else:
-            return node_2
+            self._visited_nodes += 1
+            distance = self._node_distance(pivot_node, node, math.inf if radius is None else radius)
+            if max_distance is None or distance <= max_distance:
+                if len(best_nodes) < k:
+                    heapq.heappush(best_nodes, (-distance, id(node), node))
+                elif distance < -best_nodes[0][0]:
+                    heapq.heapreplace(best_nodes, (-distance, id(node), node))
+
+            axis = depth % self.DIMENSION
+
+            if point[axis] < node.point[axis]:
+                next_branch = node.left_child
+                opposite_branch = node.right_child
+            else:
+                next_branch = node.right_child
+                opposite_branch = node.left_child
 
-    def _build_tree(self, nodes_list: List[Node], depth=0, parent: Node = None) -> Union[Node, None]:
+            if opposite_branch is not None:
+                stack.append((opposite_branch, depth + 1, max(bound, self._axis_distance(pivot_node, node, axis))))
+            if next_branch is not None:
+                stack.append((next_branch, depth + 1, bound))
+
+    def _iter_nearest(self, root: Node, pivot_node: Node) -> Iterator[Node]:
+        """
+        Best-first search: the subtrees wait in a priority queue with the lower bound of their distance,
+        the nodes wait with their exact distance, so a node is yielded
+        once nothing left in the queue can be closer
+        :param root: Root node of K-d tree
+        :param pivot_node: Node with the point to which we are looking for the closest
+        :return: Generator of nodes sorted by distance to the pivot
+        """
+        point = pivot_node.point
+
+        # (distance or its lower bound, 0 for a node and 1 for a subtree, id, node, depth)
+        queue = [(0.0, 1, id(root), root, 0)] if root is not None else []
+
+        while queue:
+            bound, is_subtree, _, node, depth = heapq.heappop(queue)
+
+            if not is_subtree:
+                yield node
+                continue
+
+            heapq.heappush(queue, (self._node_distance(pivot_node, node), 0, id(node), node, depth))
+
+            axis = depth % self.DIMENSION
+
+            if point[axis] < node.point[axis]:
+                next_branch = node.left_child
+                opposite_branch = node.right_child
+            else:
+                next_branch = node.right_child
+                opposite_branch = node.left_child
+
+            if opposite_branch is not None:
+                plane = max(bound, self._axis_distance(pivot_node, node, axis))
+                heapq.heappush(queue, (plane, 1, id(opposite_branch), opposite_branch, depth + 1))
+            if next_branch is not None:
+                heapq.heappush(queue, (bound, 1, id(next_branch), next_branch, depth + 1))
+
+    def _radius_search(self, root: Node, pivot_node: Node, radius: float, found: list = None) -> int:
         """
-        Builds a k-d tree
+        Traverses the tree skipping subtrees whose splitting plane is further than radius,
+        counts the nodes in radius and collects them with their distances if found is passed
+        :param root: Root node of K-d tree
+        :param pivot_node: Node with the center of the search
+        :param radius: Search radius
+        :param found: List for (distance, node) pairs or None to count only
+        :return: Number of nodes in radius
+        """
+        point = pivot_node.point
+        count = 0
+        stack = [(root, 0)] if root is not None else []
+
+        while stack:
+            node, depth = stack.pop()
+
+            distance = self._node_distance(pivot_node, node, radius)
+            if distance <= radius:
+                count += 1
+                if found is not None:
+                    found.append((distance, node))
+
+            axis = depth % self.DIMENSION
+
+            if point[axis] < node.point[axis]:
+                next_branch = node.left_child
+                opposite_branch = node.right_child
+            else:
+                next_branch = node.right_child
+                opposite_branch = node.left_child
+
+            if opposite_branch is not None and self._axis_distance(pivot_node, node, axis) <= radius:
+                stack.append((opposite_branch, depth + 1))
+            if next_branch is not None:
+                stack.append((next_branch, depth + 1))
+
+        return count
+
+    def _build_tree(self, nodes_list: List[Node], depth=0, processes: int = 1) -> Union[Node, None]:
+        """
+        Builds a k-d tree level by level from the median split of the points,
+        the whole build costs O(n log n) without copying node lists
         :param nodes_list: The list of points from which to build the tree
-        :param depth: Recursive parameter
-        :param parent: Recursive parameter
-        :return:
+        :param depth: Depth of the subtree root, defines the first splitting axis
+        :param processes: Number of processes splitting the points
+        :return: Root Node of the built tree
         """
         length = len(nodes_list)
 
         if length <= 0:
             return None
 
-        axis = depth % self.DIMENSION
+        if length <= self.SMALL_BUILD_SIZE:
+            return self._build_small_tree(nodes_list, depth)
+
+        coords = np.array([node.point.points for node in nodes_list], dtype=np.float64).reshape(length, 2)
 
-        # Sort point by axis (by 'x' or 'y' )
-        sorted_points = [node for node in sorted(nodes_list, key=lambda node: node.point[axis])]
+        return self._link_levels(tree_levels(coords[:, 0], coords[:, 1], depth, processes),
+                                 lambda medians: [nodes_list[node_index] for node_index in medians.tolist()])
 
-        root = sorted_points[length // 2]
+    def _build_arrays(self, xs: np.ndarray, ys: np.ndarray, ids: np.ndarray, processes: int = 1) -> Union[Node, None]:
+        """
+        Builds a k-d tree from the coordinate arrays,
+        the nodes are created only when their level is linked
+        :param xs: X coordinates of the points
+        :param ys: Y coordinates of the points
+        :param ids: Data of the points
+        :param processes: Number of processes splitting the points
+        :return: Root Node of the built tree
+        """
+        def level_nodes(medians: np.ndarray) -> List[Node]:
+            return [Node(Point(x, y), data=data)
+                    for x, y, data in zip(xs[medians].tolist(), ys[medians].tolist(), ids[medians].tolist())]
 
-        # Left part
-        self._build_tree(sorted_points[:length // 2], depth + 1, root)
-        # Right part
-        self._build_tree(sorted_points[length // 2 + 1:], depth + 1, root)
+        if len(xs) <= self.SMALL_BUILD_SIZE:
+            return self._build_small_tree(level_nodes(np.arange(len(xs))))
 
-        # The parent node has a opposite partition plane
-        parent_axis = 1 - axis
+        return self._link_levels(tree_levels(xs, ys, 0, processes), level_nodes)
 
-        if parent is not None:
-            if root.point[parent_axis] < parent.point[parent_axis]:
-                parent.left_child = root
-            else:
-                parent.right_child = root
+    @staticmethod
+    def _link_levels(levels, level_nodes) -> Node:
+        """
+        Links the nodes of the median split level by level
+        :param levels: Levels of the split in the format of split_levels with the bounds
+        :param level_nodes: Function returning the list of nodes for an array of point indices
+        :return: Root Node of the built tree
+        """
+        root = None
+        parents = [None]
+
+        for medians, sizes, _, parent_indices, left_flags, bounds in levels:
+            medians = level_nodes(medians)
+
+            for node, size, box, parent_index, left in zip(medians, sizes.tolist(), bounds.tolist(),
+                                                           parent_indices.tolist(), left_flags.tolist()):
+                node.size = size
+                node.bounds = tuple(box)
+                parent = parents[parent_index]
+                if parent is None:
+                    root = node
+                elif left:
+                    parent.left_child = node
+                else:
+                    parent.right_child = node
+
+            parents = medians
 
         return root
 
-    def _entry_field(self, start_pos: Point, end_pos: Point, node: Node, nodes_in_area: list, depth=0) -> None:
+    def _build_small_tree(self, nodes_list: List[Node], depth=0) -> Union[Node, None]:
         """
-        Iterated by nodes, depending on their location, relative to the area, goes
-        to the left or right subtree, otherwise if the area intersects the dimension of current node,
-        checks if the node is in the area, then iterates through both subtrees
-        :param start_pos: Start area position
-        :param end_pos: End area position
-        :param node: Current Node
-        :param depth: Tree depth
-        :return: None
+        Builds a k-d tree recursively with the same medians as _build_tree
+        :param nodes_list: The list of points from which to build the tree
+        :param depth: Recursive parameter
+        :return: Root Node of the built tree
         """
-        if node is None:
+        length = len(nodes_list)
+
+        if length <= 0:
             return None
 
         axis = depth % self.DIMENSION
-        point = node.point
+        # The sort is stable, so equal points keep the order of the list as in split_levels
+        sorted_nodes = sorted(nodes_list, key=lambda node: (node.point[axis], node.point[1 - axis]))
+
+        median = length // 2
 
-        if point[axis] > start_pos[axis] and point[axis] > end_pos[axis]:  # Area left or down
-            self._entry_field(start_pos, end_pos, node.left_child, nodes_in_area, depth + 1)
-        elif point[axis] < start_pos[axis] and point[axis] < end_pos[axis]:  # Area right or up
-            self._entry_field(start_pos, end_pos, node.right_child, nodes_in_area, depth + 1)
-        else:  # Area across axis
-            if start_pos.x <= point.x <= end_pos.x and start_pos.y <= point.y <= end_pos.y:  # Point in area
-                nodes_in_area.append(node)
-            self._entry_field(start_pos, end_pos, node.left_child, nodes_in_area, depth + 1)
-            self._entry_field(start_pos, end_pos, node.right_child, nodes_in_area, depth + 1)
+        root = sorted_nodes[median]
+        root.size = length
+        root.left_child = self._build_small_tree(sorted_nodes[:median], depth + 1)
+        root.right_child = self._build_small_tree(sorted_nodes[median + 1:], depth + 1)
+        root.bounds = self._subtree_bounds(root)
+
+        return root
 
-    def _minimum_node(self, root: Node, axis_target: int, axis_current: int) -> Union[Node, None]:
+    def _entry_field(self, start_pos: Point, end_pos: Point, node: Node) -> Iterator[Node]:
         """
-        Find node with minimum item in Kd-tree by axis_target
-        :param root: Current Node
-        :param axis_target: Dimension by which we need to find the minimum element
-        :param axis_current: Current Dimension
-        :return: Minimum node or None
+        Iterated by nodes, skips the subtrees whose bounding box does not intersect the area,
+        takes the subtrees whose bounding box lies inside the area without checking their points,
+        otherwise checks if the node is in the area, then iterates through both subtrees
+        :param start_pos: Start area position
+        :param end_pos: End area position
+        :param node: Root Node
+        :return: Generator of the nodes in the area in pre-order
         """
-        if root is None:
-            return None
-        if axis_target == axis_current:
-            if root.left_child is None:
-                return root
-            return self._minimum_node(root.left_child, axis_target, (axis_current + 1) % self.DIMENSION)
+        low_x, low_y = start_pos.x, start_pos.y
+        high_x, high_y = end_pos.x, end_pos.y
+        stack = [node] if node is not None else []
+
+        while stack:
+            node = stack.pop()
+            min_x, min_y, max_x, max_y = node.bounds
+
+            if max_x < low_x or min_x > high_x or max_y < low_y or min_y > high_y:  # Subtree out of area
+                continue
+
+            if low_x <= min_x and max_x <= high_x and low_y <= min_y and max_y <= high_y:  # Subtree in area
+                yield from self._iter_subtree(node)
+                continue
 
-        right_min = self._minimum_node(root.right_child, axis_target, (axis_current + 1) % self.DIMENSION)
-        left_min = self._minimum_node(root.left_child, axis_target, (axis_current + 1) % self.DIMENSION)
-        result = root
+            point = node.point
+            if low_x <= point.x <= high_x and low_y <= point.y <= high_y:  # Point in area
+                yield node
 
-        if right_min is not None and right_min.point[axis_target] < result.point[axis_target]:
-            result = right_min
-        if left_min is not None and left_min.point[axis_target] < result.point[axis_target]:
-            result = left_min
-        return result
+            # Right is pushed first, so the left subtree is visited first
+            if node.right_child is not None:
+                stack.append(node.right_child)
+            if node.left_child is not None:
+                stack.append(node.left_child)
 
-    def _tree_to_str(self, node: Node, level=0) -> None:
+    def _entry_count(self, start_pos: Point, end_pos: Point, node: Node) -> int:
+        """
+        Same traversal as _entry_field, but the subtrees inside the area
+        add their sizes instead of their nodes
+        :param start_pos: Start area position
+        :param end_pos: End area position
+        :param node: Root Node
+        :return: Number of nodes in the area
         """
-        Printed k-d tree
+        low_x, low_y = start_pos.x, start_pos.y
+        high_x, high_y = end_pos.x, end_pos.y
+        count = 0
+        stack = [node] if node is not None else []
+
+        while stack:
+            node = stack.pop()
+            min_x, min_y, max_x, max_y = node.bounds
+
+            if max_x < low_x or min_x > high_x or max_y < low_y or min_y > high_y:  # Subtree out of area
+                continue
+
+            if low_x <= min_x and max_x <= high_x and low_y <= min_y and max_y <= high_y:  # Subtree in area
+                count += node.size
+                continue
+
+            point = node.point
+            if low_x <= point.x <= high_x and low_y <= point.y <= high_y:  # Point in area
+                count += 1
+
+            if node.left_child is not None:
+                stack.append(node.left_child)
+            if node.right_child is not None:
+                stack.append(node.right_child)
+
+        return count
+
+    def _minimum_path(self, root: Node, axis_target: int, depth: int) -> List[Tuple[Node, int]]:
+        """
+        Find node with minimum item in Kd-tree by axis_target, ties are broken by the other axis
+        :param root: Current Node, not None
+        :param axis_target: Dimension by which we need to find the minimum element
+        :param depth: Depth of the current node
+        :return: (node, depth) pairs from the root down to the minimum node
+        """
+        # (node, depth, index of the parent in visited)
+        visited = []
+        stack = [(root, depth, -1)]
+        result = 0
+
+        while stack:
+            node, node_depth, parent = stack.pop()
+            visited.append((node, node_depth, parent))
+            point, minimum = node.point, visited[result][0].point
+
+            if (point[axis_target], point[1 - axis_target]) < (minimum[axis_target], minimum[1 - axis_target]):
+                result = len(visited) - 1
+
+            # The right subtree of the target axis can't contain smaller items
+            if node.left_child is not None:
+                stack.append((node.left_child, node_depth + 1, len(visited) - 1))
+            if node_depth % self.DIMENSION != axis_target and node.right_child is not None:
+                stack.append((node.right_child, node_depth + 1, len(visited) - 1))
+
+        path = []
+        while result >= 0:
+            node, node_depth, result = visited[result]
+            path.append((node, node_depth))
+        return path[::-1]
+
+    def _tree_to_str(self, node: Node) -> None:
+        """
+        Printed k-d tree, right subtree above the node, left subtree below
         :param node: Node for print
-        :param level: Recursion level
         :return: None
         """
-        if node is not None:
-            self._tree_to_str(node.right_child, level + 1)
-            self._output_str += (' ' * 8 * level + '->' + str(node.point) + "\n")
-            self._tree_to_str(node.left_child, level + 1)
+        lines = []
+        stack = []
+        level = 0
+
+        while stack or node is not None:
+            if node is not None:
+                stack.append((node, level))
+                node = node.right_child
+                level += 1
+            else:
+                node, level = stack.pop()
+                lines.append(' ' * 8 * level + '->' + str(node.point) + "\n")
+                node = node.left_child
+                level += 1
+
+        self._output_str += "".join(lines)
 
     @staticmethod
     def unpack(data: INIT_TREE) -> List[Node]:
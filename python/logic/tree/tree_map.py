@@ -6,6 +6,9 @@ of the tree and overrides distance calculation method
 # Standard library import
 import math
 
+# Third party imports
+import numpy as np
+
 # Local application imports
 from .tree import KdTree
 from .node import Node
@@ -17,33 +20,78 @@ class KdTreeMap(KdTree):
     method of calculating the distance between nodes,
     this is necessary for the correct operation of the
     KD tree through the objects on the map,
-    which have point coordinates - latitude longitude
+    which have point coordinates - latitude longitude.
+    In the unit sphere mode the points are compared by the chord between
+    their unit vectors, which needs no trigonometry per comparison,
+    the distances given and returned are still in metres
     """
 
     EARTH_RADIUS = 6372795
     PI = math.pi
 
-    def _node_distance(self, node_1: Node, node_2: Node) -> float:
+    def __init__(self, init_data: KdTree.INIT_TREE = None, unit_sphere: bool = False):
+        """
+        Builds a k-d tree based on the tuple of Points (latitude, longitude) and Data
+        :param init_data: Tuple with points and data by which to build a tree
+        :param unit_sphere: Compare the points by the chord on the unit sphere instead of haversine
+        """
+        self._unit_sphere = unit_sphere
+        super().__init__(init_data)
+
+    @classmethod
+    def from_arrays(cls, xs, ys, ids=None, processes: int = 1, *, unit_sphere: bool = False) -> "KdTreeMap":
+        """
+        Builds a k-d tree straight from the coordinate arrays without (Point, data) pairs,
+        the data of every node is its integer payload id
+        :param xs: Array-like of latitudes
+        :param ys: Array-like of longitudes
+        :param ids: Array-like of integer payload ids, the positions in the arrays by default
+        :param processes: Number of processes splitting the points, the tree is the same for any number
+        :param unit_sphere: Compare the points by the chord on the unit sphere instead of haversine
+        :return: Built tree
+        """
+        tree = cls(unit_sphere=unit_sphere)
+        tree.rebuild_from_arrays(xs, ys, ids, processes)
+        return tree
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, unit_sphere: bool = False) -> "KdTreeMap":
+        """
+        Loads the tree saved by save without rebuilding it
+        :param path: Path of the file
+        :param mmap: Map the arrays of the file into memory instead of reading them
+        :param unit_sphere: Compare the points by the chord on the unit sphere instead of haversine
+        :return: Loaded tree
+        """
+        tree = cls(unit_sphere=unit_sphere)
+        tree._load(path, mmap)
+        return tree
+
+    def _node_distance(self, node_1: Node, node_2: Node, limit: float = math.inf) -> float:
         """
         Calculates the distance between two points on the sphere,
-        necessary to search on the map
+        necessary to search on the map. The sines and cosines of the points are cached in the nodes,
+        the chord between the points is checked first, it is a lower bound of the distance
+        and is enough to reject the points further than limit
         :param node_1: First point
         :param node_2: Second point
+        :param limit: If the distance is greater than limit, any value greater than limit may be returned
         :return: Distance between points on map
         """
-        lat_1 = node_1.point[0] * self.PI / 180
-        lon_1 = node_1.point[1] * self.PI / 180
-        lat_2 = node_2.point[0] * self.PI / 180
-        lon_2 = node_2.point[1] * self.PI / 180
+        if self._unit_sphere:
+            return self._chord_distance(node_1, node_2)
+
+        x_1, y_1, z_1, cl1, sl1, cos_lon_1, sin_lon_1 = self._sphere_terms(node_1)
+        x_2, y_2, z_2, cl2, sl2, cos_lon_2, sin_lon_2 = self._sphere_terms(node_2)
 
-        cl1 = math.cos(lat_1)
-        cl2 = math.cos(lat_2)
-        sl1 = math.sin(lat_1)
-        sl2 = math.sin(lat_2)
+        if limit < math.inf:
+            chord = math.sqrt((x_1 - x_2) ** 2 + (y_1 - y_2) ** 2 + (z_1 - z_2) ** 2) * self.EARTH_RADIUS
+            if chord > limit:
+                return chord
 
-        delta = lon_2 - lon_1
-        cos_delta = math.cos(delta)
-        sin_delta = math.sin(delta)
+        # Cosine and sine of lon_2 - lon_1
+        cos_delta = cos_lon_1 * cos_lon_2 + sin_lon_1 * sin_lon_2
+        sin_delta = sin_lon_2 * cos_lon_1 - cos_lon_2 * sin_lon_1
 
         y = math.sqrt(pow(cl2 * sin_delta, 2) + pow(cl1 * sl2 - sl1 * cl2 * cos_delta, 2))
         x = sl1 * sl2 + cl1 * cl2 * cos_delta
@@ -52,3 +100,213 @@ class KdTreeMap(KdTree):
         dist = ad * self.EARTH_RADIUS
 
         return dist
+
+    def _axis_distance(self, pivot_node: Node, node: Node, axis: int) -> float:
+        """
+        Calculates the lower bound of the distance on the sphere from the pivot
+        to any point on the other side of the node splitting plane.
+        Latitude plane - the distance along the meridian, longitude plane - the distance
+        to the node meridian or to the antimeridian, whichever is closer
+        :param pivot_node: Node with the pivot point
+        :param node: Node whose plane splits the space
+        :param axis: Splitting axis of the node (0 - latitude, 1 - longitude)
+        :return: Distance to the splitting plane in metres
+        """
+        if self._unit_sphere:
+            return self._chord_axis_distance(pivot_node, node, axis)
+
+        if axis == 0:
+            return abs(pivot_node.point[0] - node.point[0]) * self.PI / 180 * self.EARTH_RADIUS
+
+        _, _, _, cos_lat, sin_lat, cos_lon, sin_lon = self._sphere_terms(pivot_node)
+        _, _, _, _, _, node_cos_lon, node_sin_lon = self._sphere_terms(node)
+
+        sin_delta = sin_lon * node_cos_lon - cos_lon * node_sin_lon
+        cos_delta = cos_lon * node_cos_lon + sin_lon * node_sin_lon
+
+        # The other side of the plane can also be reached across the antimeridian, lon - pi away
+        return min(self._meridian_distance(cos_lat, sin_lat, sin_delta, cos_delta),
+                   self._meridian_distance(cos_lat, sin_lat, -sin_lon, -cos_lon))
+
+    def _meridian_distance(self, cos_lat: float, sin_lat: float, sin_delta: float, cos_delta: float) -> float:
+        """
+        Calculates the distance on the sphere from a point to a meridian (pole to pole)
+        :param cos_lat: Cosine of the point latitude
+        :param sin_lat: Sine of the point latitude
+        :param sin_delta: Sine of the longitude difference between the point and the meridian
+        :param cos_delta: Cosine of the longitude difference between the point and the meridian
+        :return: Distance to the meridian
+        """
+        # Behind a right angle the closest point of the meridian is the pole
+        if cos_delta <= 0:
+            return math.acos(min(1.0, abs(sin_lat))) * self.EARTH_RADIUS
+
+        return math.asin(min(1.0, cos_lat * abs(sin_delta))) * self.EARTH_RADIUS
+
+    def _to_search_distance(self, distance: float) -> float:
+        """
+        Converts metres to the chord on the unit sphere in the unit sphere mode
+        :param distance: Distance in metres
+        :return: Distance in the units of _node_distance
+        """
+        if not self._unit_sphere:
+            return distance
+        return 2 * math.sin(min(distance / self.EARTH_RADIUS, self.PI) / 2)
+
+    def _from_search_distance(self, distance):
+        """
+        Converts the chord on the unit sphere to metres in the unit sphere mode
+        :param distance: Distance or array of distances in the units of _node_distance
+        :return: Distance in metres
+        """
+        if not self._unit_sphere:
+            return distance
+        return 2 * np.arcsin(np.minimum(distance / 2, 1.0)) * self.EARTH_RADIUS
+
+    def _sphere_terms(self, node: Node) -> tuple:
+        """
+        Calculates the unit vector and the sines and cosines of the node point once
+        and keeps them in the node cache
+        :param node: Node on the map
+        :return: (x, y, z, cos(lat), sin(lat), cos(lon), sin(lon))
+        """
+        terms = node.cache
+        if terms is None:
+            lat = node.point[0] * self.PI / 180
+            lon = node.point[1] * self.PI / 180
+            cos_lat, sin_lat = math.cos(lat), math.sin(lat)
+            cos_lon, sin_lon = math.cos(lon), math.sin(lon)
+
+            terms = (cos_lat * cos_lon, cos_lat * sin_lon, sin_lat, cos_lat, sin_lat, cos_lon, sin_lon)
+            node.cache = terms
+
+        return terms
+
+    def _chord_distance(self, node_1: Node, node_2: Node) -> float:
+        """
+        Calculates the chord between the unit vectors of two points,
+        it grows with the distance on the sphere
+        :param node_1: First point
+        :param node_2: Second point
+        :return: Chord on the unit sphere
+        """
+        x_1, y_1, z_1 = self._sphere_terms(node_1)[:3]
+        x_2, y_2, z_2 = self._sphere_terms(node_2)[:3]
+
+        return math.sqrt((x_1 - x_2) ** 2 + (y_1 - y_2) ** 2 + (z_1 - z_2) ** 2)
+
+    def _chord_axis_distance(self, pivot_node: Node, node: Node, axis: int) -> float:
+        """
+        Same lower bound as _axis_distance, but as the chord on the unit sphere
+        and calculated from the cached terms without trigonometry
+        :param pivot_node: Node with the pivot point
+        :param node: Node whose plane splits the space
+        :param axis: Splitting axis of the node (0 - latitude, 1 - longitude)
+        :return: Chord to the splitting plane
+        """
+        _, _, _, cos_lat, sin_lat, cos_lon, sin_lon = self._sphere_terms(pivot_node)
+        _, _, _, node_cos_lat, node_sin_lat, node_cos_lon, node_sin_lon = self._sphere_terms(node)
+
+        if axis == 0:
+            # The closest point of the parallel is on the pivot meridian
+            return math.hypot(cos_lat - node_cos_lat, sin_lat - node_sin_lat)
+
+        sin_delta = sin_lon * node_cos_lon - cos_lon * node_sin_lon
+        cos_delta = cos_lon * node_cos_lon + sin_lon * node_sin_lon
+
+        # The longitude difference to the antimeridian is lon - pi
+        return min(self._meridian_chord(cos_lat, sin_lat, sin_delta, cos_delta),
+                   self._meridian_chord(cos_lat, sin_lat, -sin_lon, -cos_lon))
+
+    @staticmethod
+    def _meridian_chord(cos_lat: float, sin_lat: float, sin_delta: float, cos_delta: float) -> float:
+        """
+        Calculates the chord on the unit sphere from a point to a meridian (pole to pole)
+        :param cos_lat: Cosine of the point latitude
+        :param sin_lat: Sine of the point latitude
+        :param sin_delta: Sine of the longitude difference between the point and the meridian
+        :param cos_delta: Cosine of the longitude difference between the point and the meridian
+        :return: Chord to the meridian
+        """
+        # Behind a right angle the closest point of the meridian is the pole
+        if cos_delta <= 0:
+            return math.sqrt(2 - 2 * abs(sin_lat))
+
+        # Sine of the angle to the meridian plane, the chord is 2 * sin(angle / 2)
+        sin_angle = min(1.0, cos_lat * abs(sin_delta))
+        return sin_angle * math.sqrt(2 / (1 + math.sqrt(1 - sin_angle * sin_angle)))
+
+    def _batch_distance(self, pivots: np.ndarray, coords: np.ndarray) -> np.ndarray:
+        """
+        Vectorized distance on the sphere for pairs of points
+        :param pivots: Array of first points (lat, lon) with shape (n, 2)
+        :param coords: Array of second points (lat, lon) with shape (n, 2)
+        :return: Array of distances between points on map
+        """
+        if self._unit_sphere:
+            return np.linalg.norm(self._batch_unit_vectors(pivots) - self._batch_unit_vectors(coords), axis=1)
+
+        lat_1 = np.radians(pivots[:, 0])
+        lat_2 = np.radians(coords[:, 0])
+        delta = np.radians(coords[:, 1] - pivots[:, 1])
+
+        cl1 = np.cos(lat_1)
+        cl2 = np.cos(lat_2)
+        sl1 = np.sin(lat_1)
+        sl2 = np.sin(lat_2)
+        cos_delta = np.cos(delta)
+
+        y = np.hypot(cl2 * np.sin(delta), cl1 * sl2 - sl1 * cl2 * cos_delta)
+        x = sl1 * sl2 + cl1 * cl2 * cos_delta
+
+        return np.arctan2(y, x) * self.EARTH_RADIUS
+
+    def _batch_axis_distance(self, pivots: np.ndarray, coords: np.ndarray, axes: np.ndarray) -> np.ndarray:
+        """
+        Vectorized _axis_distance for pairs of pivots and nodes
+        :param pivots: Array of pivots (lat, lon) with shape (n, 2)
+        :param coords: Array of node points (lat, lon) with shape (n, 2)
+        :param axes: Splitting axes of the nodes
+        :return: Array of distances to the splitting planes in metres (chords in the unit sphere mode)
+        """
+        lat = np.radians(pivots[:, 0])
+        lon = np.radians(pivots[:, 1])
+        node_lon = np.radians(coords[:, 1])
+
+        lat_distance = np.abs(lat - np.radians(coords[:, 0])) * self.EARTH_RADIUS
+
+        antimeridian_delta = np.where(lon >= node_lon, self.PI - lon, self.PI + lon)
+        lon_distance = np.minimum(self._batch_meridian_distance(lat, np.abs(lon - node_lon)),
+                                  self._batch_meridian_distance(lat, antimeridian_delta))
+
+        distance = np.where(axes == 0, lat_distance, lon_distance)
+
+        if self._unit_sphere:
+            return 2 * np.sin(np.minimum(distance / self.EARTH_RADIUS, self.PI) / 2)
+        return distance
+
+    def _batch_meridian_distance(self, lat: np.ndarray, delta: np.ndarray) -> np.ndarray:
+        """
+        Vectorized _meridian_distance
+        :param lat: Latitudes of the points in radians
+        :param delta: Longitude differences between the points and the meridians in radians
+        :return: Distances to the meridians
+        """
+        delta = np.minimum(delta, 2 * self.PI - delta)
+        to_meridian = np.arcsin(np.minimum(1.0, np.cos(lat) * np.sin(np.minimum(delta, self.PI / 2))))
+        to_pole = self.PI / 2 - np.abs(lat)
+
+        return np.where(delta >= self.PI / 2, to_pole, to_meridian) * self.EARTH_RADIUS
+
+    @staticmethod
+    def _batch_unit_vectors(coords: np.ndarray) -> np.ndarray:
+        """
+        Vectorized unit vectors of the points
+        :param coords: Array of points (lat, lon) with shape (n, 2)
+        :return: Array of unit vectors with shape (n, 3)
+        """
+        lat = np.radians(coords[:, 0])
+        lon = np.radians(coords[:, 1])
+        cos_lat = np.cos(lat)
+
+        return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
@@ -1,7 +1,21 @@
+import importlib
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
-from ..logic.point import Point
+from types import SimpleNamespace
+from unittest import mock
+from ..logic.point import Point, FrozenPoint
+from ..logic.tree import build
 from ..logic.tree.node import Node
 from ..logic.tree.tree import KdTree
+from ..logic.tree.tree_map import KdTreeMap
+from ..logic.tree.flat_tree import FlatKdTree
+from ..logic.tree.flat_tree_map import FlatKdTreeMap
+from ..logic.map.point_store import PointStore
+from ..logic.map.tag_table import TagTable
+from ..json_connect.json_connector import JsonConnector
 
 DATA_SHORT = (
     (Point(5, 4), None),
@@ -31,6 +45,28 @@ DATA_SHORT_PARAM = (
 )
 
 
+def tree_height(node: Node) -> int:
+    """
+    Number of nodes on the longest path from the node down to a leaf
+    :param node: Root of the subtree or None
+    :return: Height of the subtree
+    """
+    return 0 if node is None else 1 + max(tree_height(node.left_child), tree_height(node.right_child))
+
+
+def attached_closest(name: str) -> int:
+    """
+    Worker of the process pool, attaches to the shared tree and searches in it
+    :param name: Name of the shared memory block
+    :return: Id of the point closest to (15, 15)
+    """
+    tree = FlatKdTree.attach(name)
+    try:
+        return tree.closest_node(Point(15, 15)).data["id"]
+    finally:
+        tree.close()
+
+
 class TestPoint(unittest.TestCase):
     def test_init(self):
         point = Point(3, 4)
@@ -52,6 +88,19 @@ class TestPoint(unittest.TestCase):
         self.assertEqual(point.x, 2)
         self.assertEqual(point.y, -1)
 
+    def test_hash(self):
+        self.assertEqual(hash(Point(1, 2)), hash(Point(1.0, 2.0)))
+        self.assertEqual(len({Point(1, 2), Point(1, 2), FrozenPoint(1, 2), Point(2, 1)}), 2)
+
+    def test_frozen(self):
+        point = FrozenPoint(1, 2)
+
+        self.assertEqual(point, Point(1, 2))
+        with self.assertRaises(AttributeError):
+            point.x = 3
+        with self.assertRaises(AttributeError):
+            point.z = 3
+
 
 class TestNode(unittest.TestCase):
     def test_init(self):
@@ -93,6 +142,29 @@ class TestNode(unittest.TestCase):
         self.assertEqual(root_node.right_child, child_1)
         self.assertEqual(root_node.left_child, child_2)
 
+    def test_size(self):
+        node = Node(Point(1, 1))
+
+        self.assertEqual(node.size, 1)
+        node.size = 3
+        self.assertEqual(node.size, 3)
+
+    def test_bounds(self):
+        node = Node(Point(1, 2))
+
+        self.assertEqual(node.bounds, (1, 2, 1, 2))
+        node.bounds = (0, 0, 3, 3)
+        self.assertEqual(node.bounds, (0, 0, 3, 3))
+
+    def test_cache(self):
+        node = Node(Point(1, 1))
+
+        self.assertIsNone(node.cache)
+        node.cache = (1, 2)
+        self.assertEqual(node.cache, (1, 2))
+        node.point = Point(2, 2)
+        self.assertIsNone(node.cache)
+
     def test_point(self):
         node = Node(Point(1, 1))
         point = Point(12, 12)
@@ -103,6 +175,8 @@ class TestNode(unittest.TestCase):
 
 
 class TestTree(unittest.TestCase):
+    GRID = tuple((Point(i % 10, i // 10), {"id": i}) for i in range(100))
+
     def test_build_1(self):
         tree = KdTree(DATA_SHORT)
         root = tree.get_root()
@@ -160,6 +234,39 @@ class TestTree(unittest.TestCase):
         nearest_node = tree.closest_node(Point(438, 681))
         self.assertEqual(nearest_node.point, Point(343, 858))
 
+    def test_k_closest(self):
+        tree = KdTree(DATA_SHORT)
+        nearest_nodes = tree.k_closest_nodes(Point(9, 4), 3)
+        self.assertEqual([node.point for node in nearest_nodes], [Point(10, 2), Point(8, 7), Point(5, 4)])
+
+        nearest_nodes = tree.k_closest_nodes(Point(9, 4), 3, max_distance=3.5)
+        self.assertEqual([node.point for node in nearest_nodes], [Point(10, 2), Point(8, 7)])
+
+        self.assertEqual(len(tree.k_closest_nodes(Point(9, 4), 10)), len(DATA_SHORT))
+        self.assertRaises(ValueError, tree.k_closest_nodes, Point(9, 4), 0)
+        self.assertEqual(KdTree().k_closest_nodes(Point(9, 4), 2), [])
+
+    def test_iter_nearest(self):
+        tree = KdTree(self.GRID)
+
+        nearest = tree.iter_nearest(Point(4.9, 5.2))
+        self.assertEqual([next(nearest).data["id"] for _ in range(3)], [55, 65, 54])
+        self.assertEqual(len(list(nearest)), 97)
+        self.assertEqual(list(KdTree().iter_nearest(Point(0, 0))), [])
+
+    def test_closest_batch(self):
+        tree = KdTree(DATA_LONG)
+        indices, distances = tree.closest_nodes_batch([(438, 681), (9, 4), (700, 200)])
+        nodes = tree.get_nodes()
+
+        self.assertEqual(nodes[indices[0]].point, Point(343, 858))
+        self.assertEqual(nodes[indices[1]].point, Point(207, 313))
+        self.assertEqual(nodes[indices[2]].point, Point(751, 177))
+        self.assertAlmostEqual(distances[2], Point(700, 200).euclidean_distance(Point(751, 177)))
+
+        indices, distances = KdTree().closest_nodes_batch([(1, 1)])
+        self.assertEqual(indices[0], -1)
+
     def test_add(self):
         tree = KdTree(DATA_SHORT)
         root = tree.get_root()
@@ -175,6 +282,96 @@ class TestTree(unittest.TestCase):
         self.assertEqual(root.left_child.right_child.left_child.point, Point(1, 5))
         self.assertEqual(root.left_child.right_child.right_child.point, Point(6, 5))
 
+    def test_balance(self):
+        tree = KdTree()
+        for i in range(2000):
+            tree.insert(Point(i, i), {"id": i})
+        for i in range(0, 2000, 3):
+            tree.remove(Point(i, i))
+
+        root = tree.get_root()
+        self.assertEqual(root.size, 2000 - len(range(0, 2000, 3)))
+        self.assertLessEqual(tree_height(root), 30)
+        self.assertEqual(tree.closest_node(Point(1000.2, 1000.1)).data["id"], 1000)
+        self.assertEqual(tree.closest_node(Point(999.2, 999.1)).data["id"], 1000)
+
+    def test_balance_duplicates(self):
+        tree = KdTree()
+        with mock.patch.object(tree, "_build_tree", wraps=tree._build_tree) as rebuild:
+            for i in range(400):
+                tree.insert(Point(1, 1), {"id": i})
+        # A rebuild splits the equal points evenly, so it is not repeated on every insert
+        self.assertLess(rebuild.call_count, 200)
+        self.assertLessEqual(tree_height(tree.get_root()), 15)
+
+        tree = KdTree()
+        for i in range(3000):
+            tree.insert(Point(i % 6, 0), {"id": i})
+        self.assertLessEqual(tree_height(tree.get_root()), 25)
+        for _ in range(500):
+            tree.remove(Point(0, 0))
+        self.assertEqual(tree.get_root().size, 2500)
+        self.assertEqual(tree.closest_node(Point(-1, 0)).point, Point(1, 0))
+
+    def test_bounds(self):
+        tree = KdTree(self.GRID)
+        self.assertEqual(tree.get_root().bounds, (0, 0, 9, 9))
+
+        tree.insert(Point(-5, 20))
+        self.assertEqual(tree.get_root().bounds, (-5, 0, 9, 20))
+        tree.remove(Point(-5, 20))
+        self.assertEqual(tree.get_root().bounds, (0, 0, 9, 9))
+
+        found = tree.check_entry(Point(2, 3), Point(7, 8))
+        self.assertEqual(sorted(node.data["id"] for node in found),
+                         [y * 10 + x for y in range(3, 9) for x in range(2, 8)])
+        self.assertEqual(len(tree.check_entry(Point(-1, -1), Point(10, 10))), 100)
+        self.assertEqual(tree.check_entry(Point(10, 10), Point(20, 20)), [])
+
+    def test_iter_entry(self):
+        tree = KdTree(self.GRID)
+
+        found = tree.iter_entry(Point(2, 3), Point(7, 8))
+        self.assertEqual(next(found).data["id"], tree.check_entry(Point(2, 3), Point(7, 8))[0].data["id"])
+        self.assertEqual(list(tree.iter_entry(Point(-1, -1), Point(10, 10))),
+                         tree.check_entry(Point(-1, -1), Point(10, 10)))
+        self.assertEqual(list(tree.iter_entry(Point(10, 10), Point(20, 20))), [])
+        with self.assertRaises(ValueError):
+            tree.iter_entry(Point(1, 1), Point(0, 0))
+
+    def test_count_in_area(self):
+        tree = KdTree(self.GRID)
+
+        self.assertEqual(tree.count_in_area(Point(2, 3), Point(7, 8)), 36)
+        self.assertEqual(tree.count_in_area(Point(-1, -1), Point(10, 10)), 100)
+        self.assertEqual(tree.count_in_area(Point(10, 10), Point(20, 20)), 0)
+
+        tree.insert(Point(5, 5))
+        tree.remove(Point(0, 0))
+        self.assertEqual(tree.count_in_area(Point(0, 0), Point(5, 5)), 36)
+        self.assertEqual(KdTree().count_in_area(Point(0, 0), Point(1, 1)), 0)
+        with self.assertRaises(ValueError):
+            tree.count_in_area(Point(1, 1), Point(0, 0))
+
+    def test_deep_tree(self):
+        tree = KdTree()
+        # Disable rebalancing to get a degenerate tree deeper than the recursion limit
+        tree.BALANCE_FACTOR = 1
+        for i in range(400):
+            tree.insert(Point(i, i))
+
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(200)
+        try:
+            self.assertEqual(tree.closest_node(Point(200.2, 200.1)).point, Point(200, 200))
+            self.assertEqual(len(tree.check_entry(Point(10, 10), Point(19, 19))), 10)
+            self.assertEqual(tree.count_within_radius(Point(100, 100), 1.5), 3)
+            self.assertEqual(len(str(tree).splitlines()), 400)
+            tree.remove(Point(0, 0))
+            self.assertEqual(tree.get_root().size, 399)
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+
     def test_del_1(self):
         tree = KdTree(
             (
@@ -224,6 +421,85 @@ class TestTree(unittest.TestCase):
         self.assertEqual(res[0].point, Point(13, 3))
         self.assertEqual(res[1].point, Point(10, 2))
 
+    def test_build_duplicates(self):
+        data = tuple((Point(x % 3, x % 2), {"id": x}) for x in range(20))
+        tree = KdTree(data)
+
+        def walk(node, depth=0):
+            if node is None:
+                return []
+            axis = depth % KdTree.DIMENSION
+            left, right = walk(node.left_child, depth + 1), walk(node.right_child, depth + 1)
+            key = (node.point[axis], node.point[1 - axis])
+            self.assertTrue(all((item.point[axis], item.point[1 - axis]) <= key for item in left))
+            self.assertTrue(all((item.point[axis], item.point[1 - axis]) >= key for item in right))
+            return left + [node] + right
+
+        self.assertEqual(sorted(node.data["id"] for node in walk(tree.get_root())), list(range(20)))
+
+    def test_build_repeated(self):
+        xs = [0] * 2000 + list(range(2000))
+        tree = KdTree.from_arrays(xs, xs)
+
+        self.assertLessEqual(tree_height(tree.get_root()), 12)
+        self.assertEqual(len(tree.within_radius(Point(0, 0), 0.5)), 2001)
+
+        # The points equal to a median are on both sides of it, all of them are still found and removed
+        for _ in range(2001):
+            tree.remove(Point(0, 0))
+        self.assertEqual(tree.get_root().size, 1999)
+        self.assertEqual(tree.closest_node(Point(0, 0)).point, Point(1, 1))
+
+    def test_save_load(self):
+        tree = KdTree(self.GRID)
+        tree.insert(Point(4.5, 4.5), {"id": 100})
+        tree.remove(Point(0, 0))
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "tree.kd")
+            tree.save(path)
+
+            for mmap in (True, False):
+                loaded = KdTree.load(path, mmap=mmap)
+                self.assertEqual([(node.point, node.data, node.size, node.bounds) for node in loaded.get_nodes()],
+                                 [(node.point, node.data, node.size, node.bounds) for node in tree.get_nodes()])
+                self.assertEqual(loaded.closest_node(Point(4.6, 4.4)).data, {"id": 100})
+                self.assertEqual(loaded.closest_nodes_batch([[9, 9]])[0].tolist(),
+                                 tree.closest_nodes_batch([[9, 9]])[0].tolist())
+                del loaded
+
+            KdTree().save(path)
+            self.assertIsNone(KdTree.load(path).get_root())
+
+            with open(path, "r+b") as file:
+                file.write(b"broken")
+            self.assertRaises(ValueError, KdTree.load, path)
+
+    def test_from_arrays(self):
+        xs = [i % 10 for i in range(100)]
+        ys = [i // 10 for i in range(100)]
+        tree = KdTree.from_arrays(xs, ys, [i + 1000 for i in range(100)])
+        expected = KdTree([(Point(x, y), i + 1000) for i, (x, y) in enumerate(zip(xs, ys))])
+
+        self.assertEqual([(node.point, node.data, node.size) for node in tree.get_nodes()],
+                         [(node.point, node.data, node.size) for node in expected.get_nodes()])
+        self.assertEqual(tree.closest_node(Point(4.9, 5.2)).data, 1055)
+        self.assertEqual(KdTree.from_arrays([1, 2], [3, 4]).closest_node(Point(2, 4)).data, 1)
+        self.assertIsNone(KdTree.from_arrays([], []).get_root())
+        with self.assertRaises(ValueError):
+            KdTree.from_arrays([1, 2], [3])
+
+    def test_parallel_build(self):
+        xs = [i % 7 for i in range(300)]
+        ys = [(i * 13) % 11 for i in range(300)]
+        expected = KdTree.from_arrays(xs, ys)
+
+        with mock.patch.object(build, "PARALLEL_MIN_SIZE", 0):
+            for processes in (2, 3):
+                tree = KdTree.from_arrays(xs, ys, processes=processes)
+                self.assertEqual([(node.point, node.data, node.size, node.bounds) for node in tree.get_nodes()],
+                                 [(node.point, node.data, node.size, node.bounds) for node in expected.get_nodes()])
+
     def test_empty(self):
         t = KdTree()
         self.assertEqual(t.get_root(), None)
@@ -239,5 +515,404 @@ class TestTree(unittest.TestCase):
         self.assertEqual(t.rebuild_tree(DATA_SHORT).point, Point(8, 7))
 
 
+class TestTreeMap(unittest.TestCase):
+    GRID = tuple(
+        (Point(56 + lat / 100, 92 + lon / 100), {"id": lat * 20 + lon}) for lat in range(20) for lon in range(20)
+    )
+
+    def test_closest_node(self):
+        tree = KdTreeMap(self.GRID)
+        pivot = Point(56.052, 92.139)
+        nearest_node = tree.closest_node(pivot)
+        self.assertEqual(nearest_node.point, Point(56.05, 92.14))
+
+    def test_node_distance_limit(self):
+        tree = KdTreeMap()
+        node_1 = Node(Point(56.0, 92.0))
+        node_2 = Node(Point(56.01, 92.01))
+        distance = tree._node_distance(node_1, node_2)
+
+        self.assertAlmostEqual(distance, 1274.3, places=1)
+        self.assertEqual(tree._node_distance(node_1, node_2, distance + 1), distance)
+        self.assertGreater(tree._node_distance(node_1, node_2, 100), 100)
+
+    def test_closest_node_prunes(self):
+        tree = KdTreeMap(self.GRID)
+        tree.closest_node(Point(56.101, 92.101))
+        self.assertLess(tree.visited_nodes, len(self.GRID) // 4)
+
+    def test_closest_node_approximate(self):
+        tree = KdTreeMap(self.GRID)
+        pivot_node = Node(Point(56.052, 92.139))
+        exact = tree._node_distance(pivot_node, tree.closest_node(pivot_node.point))
+        self.assertEqual(tree.error_bound, 1.0)
+
+        for epsilon, max_visited in ((0.5, None), (0.0, 5), (1.0, 3)):
+            node = tree.closest_node(pivot_node.point, epsilon=epsilon, max_visited=max_visited)
+            self.assertLessEqual(tree._node_distance(pivot_node, node), exact * tree.error_bound + 1e-9)
+            if max_visited is None:
+                self.assertLessEqual(tree.error_bound, 1 + epsilon)
+            else:
+                self.assertLessEqual(tree.visited_nodes, max_visited)
+
+        with self.assertRaises(ValueError):
+            tree.closest_node(pivot_node.point, epsilon=-1)
+        with self.assertRaises(ValueError):
+            tree.closest_node(pivot_node.point, max_visited=0)
+
+    def test_k_closest(self):
+        tree = KdTreeMap(self.GRID)
+        pivot = Point(56.052, 92.139)
+        pivot_node = Node(pivot)
+        expected = sorted(self.GRID, key=lambda item: tree._node_distance(pivot_node, Node(item[0])))[:5]
+
+        nearest_nodes = tree.k_closest_nodes(pivot, 5)
+        self.assertEqual([node.data["id"] for node in nearest_nodes], [item[1]["id"] for item in expected])
+
+    def test_iter_nearest(self):
+        tree = KdTreeMap(self.GRID)
+        pivot_node = Node(Point(56.052, 92.139))
+        expected = sorted(tree._node_distance(pivot_node, Node(item[0])) for item in self.GRID)
+
+        distances = [tree._node_distance(pivot_node, node) for node in tree.iter_nearest(pivot_node.point)]
+        self.assertEqual(distances, expected)
+
+    def test_within_radius(self):
+        tree = KdTreeMap(self.GRID)
+        pivot = Point(56.052, 92.139)
+        pivot_node = Node(pivot)
+        expected = sorted(
+            (tree._node_distance(pivot_node, Node(item[0])), item[1]["id"])
+            for item in self.GRID if tree._node_distance(pivot_node, Node(item[0])) <= 1500
+        )
+
+        nodes = tree.within_radius(pivot, 1500, sort=True)
+        self.assertEqual([node.data["id"] for node in nodes], [item_id for _, item_id in expected])
+        self.assertEqual(sorted(node.data["id"] for node in tree.within_radius(pivot, 1500)),
+                         sorted(item_id for _, item_id in expected))
+        self.assertEqual(tree.count_within_radius(pivot, 1500), len(expected))
+        self.assertEqual(tree.count_within_radius(pivot, 10), 0)
+        self.assertEqual(KdTreeMap().within_radius(pivot, 1500), [])
+
+    def test_closest_batch(self):
+        tree = KdTreeMap(self.GRID)
+        pivots = [(56.052, 92.139), (55.9, 91.9), (56.3, 92.05), (56.11, 92.11)]
+        indices, distances = tree.closest_nodes_batch(pivots)
+        nodes = tree.get_nodes()
+
+        for pivot, index, distance in zip(pivots, indices, distances):
+            nearest_node = tree.closest_node(Point(*pivot))
+            self.assertEqual(nodes[index].point, nearest_node.point)
+            self.assertAlmostEqual(distance, tree._node_distance(Node(Point(*pivot)), nearest_node), places=4)
+
+    def test_closest_node_antimeridian(self):
+        tree = KdTreeMap(((Point(0, -179.9), None), (Point(0, 170), None), (Point(0, 150), None)))
+        self.assertEqual(tree.closest_node(Point(0, 179.9)).point, Point(0, -179.9))
+
+    def test_from_arrays(self):
+        tree = KdTreeMap.from_arrays([item[0].x for item in self.GRID], [item[0].y for item in self.GRID],
+                                     unit_sphere=True)
+        self.assertEqual(tree.closest_node(Point(56.052, 92.139)).data, 5 * 20 + 14)
+
+    def test_unit_sphere(self):
+        tree = KdTreeMap(self.GRID)
+        sphere_tree = KdTreeMap(self.GRID, unit_sphere=True)
+        pivot = Point(56.052, 92.139)
+
+        self.assertEqual(sphere_tree.closest_node(pivot).point, tree.closest_node(pivot).point)
+        self.assertEqual([node.data["id"] for node in sphere_tree.k_closest_nodes(pivot, 5)],
+                         [node.data["id"] for node in tree.k_closest_nodes(pivot, 5)])
+        self.assertEqual(sphere_tree.count_within_radius(pivot, 3000), tree.count_within_radius(pivot, 3000))
+
+        _, distances = tree.closest_nodes_batch([pivot.points])
+        _, sphere_distances = sphere_tree.closest_nodes_batch([pivot.points])
+        self.assertAlmostEqual(sphere_distances[0], distances[0], places=3)
+
+        polar_tree = KdTreeMap(((Point(89.9, 0), None), (Point(89.9, 180), None), (Point(0, -179.9), None)),
+                               unit_sphere=True)
+        self.assertEqual(polar_tree.closest_node(Point(89.95, 179)).point, Point(89.9, 180))
+        self.assertEqual(polar_tree.closest_node(Point(0, 179.9)).point, Point(0, -179.9))
+
+
+class TestFlatTree(unittest.TestCase):
+    DATA = tuple((Point(x * 7 % 31, x * 11 % 17), {"id": x}) for x in range(200))
+
+    def test_build(self):
+        tree = FlatKdTree(DATA_SHORT)
+        self.assertEqual(len(tree), len(DATA_SHORT))
+        self.assertEqual(tree.get_root().point, Point(8, 7))
+
+    def test_closest_point(self):
+        tree = FlatKdTree(DATA_SHORT_PARAM)
+        nearest_node = tree.closest_node(Point(9, 4))
+        self.assertEqual(nearest_node.point, Point(10, 2))
+        self.assertEqual(nearest_node.data["2"], 2)
+
+        tree = FlatKdTree(DATA_LONG)
+        self.assertEqual(tree.closest_node(Point(438, 681)).point, Point(343, 858))
+
+    def test_entry(self):
+        tree = FlatKdTree(DATA_SHORT)
+        res = tree.check_entry(Point(9, 1), Point(14, 3))
+        self.assertEqual(sorted(node.point.points for node in res), [(10, 2), (13, 3)])
+        self.assertRaises(ValueError, tree.check_entry, Point(14, 3), Point(9, 1))
+
+    def test_same_as_tree(self):
+        tree = KdTree(self.DATA)
+        flat_tree = FlatKdTree(self.DATA)
+
+        for pivot in (Point(3.3, 4.1), Point(15, 15), Point(-5, 40), Point(29.5, 0.2)):
+            self.assertEqual(flat_tree.closest_node(pivot).point.euclidean_distance(pivot),
+                             tree.closest_node(pivot).point.euclidean_distance(pivot))
+
+        self.assertEqual(sorted(node.data["id"] for node in flat_tree.check_entry(Point(5, 2), Point(20, 9))),
+                         sorted(node.data["id"] for node in tree.check_entry(Point(5, 2), Point(20, 9))))
+
+    def test_leaf_size(self):
+        tree = FlatKdTree(self.DATA)
+        bucket_tree = FlatKdTree(self.DATA, leaf_size=16)
+
+        for pivot in (Point(3.3, 4.1), Point(15, 15), Point(-5, 40), Point(29.5, 0.2)):
+            self.assertEqual(bucket_tree.closest_node(pivot).point.euclidean_distance(pivot),
+                             tree.closest_node(pivot).point.euclidean_distance(pivot))
+
+        self.assertEqual(sorted(node.data["id"] for node in bucket_tree.check_entry(Point(5, 2), Point(20, 9))),
+                         sorted(node.data["id"] for node in tree.check_entry(Point(5, 2), Point(20, 9))))
+        self.assertEqual(FlatKdTree(DATA_SHORT, leaf_size=64).closest_node(Point(9, 4)).point, Point(10, 2))
+        self.assertRaises(ValueError, FlatKdTree, DATA_SHORT, 0)
+
+    def test_save_load(self):
+        data = tuple((Point(x * 7 % 31, x * 11 % 17), {"id": x, "name": f"cafe {x}"}) for x in range(200))
+        tree = FlatKdTree(data, leaf_size=8)
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "flat.kd")
+            tree.save(path)
+
+            for mmap in (True, False):
+                loaded = FlatKdTree.load(path, mmap=mmap, leaf_size=8)
+                self.assertEqual(len(loaded), 200)
+                for pivot in (Point(3.3, 4.1), Point(15, 15), Point(29.5, 0.2)):
+                    self.assertEqual(loaded.closest_node(pivot).data, tree.closest_node(pivot).data)
+                self.assertEqual([node.data for node in loaded.check_entry(Point(5, 2), Point(20, 9))],
+                                 [node.data for node in tree.check_entry(Point(5, 2), Point(20, 9))])
+                del loaded
+
+            self.assertRaises(ValueError, KdTree.load, path)
+
+    def test_fixed_point(self):
+        data = tuple((Point(56 + x * 7 % 31 * 1e-3, 92 + x * 11 % 17 * 1e-3), {"id": x}) for x in range(200))
+        tree = FlatKdTree(data, leaf_size=8)
+        fixed_tree = FlatKdTree(data, leaf_size=8, fixed_point=True)
+
+        for pivot in (Point(56.0033, 92.0041), Point(56.015, 92.015), Point(55.9, 92.3)):
+            self.assertEqual(fixed_tree.closest_node(pivot).point, tree.closest_node(pivot).point)
+        self.assertEqual(sorted(node.data["id"] for node in fixed_tree.check_entry(Point(56.005, 92.002),
+                                                                                   Point(56.02, 92.009))),
+                         sorted(node.data["id"] for node in tree.check_entry(Point(56.005, 92.002),
+                                                                             Point(56.02, 92.009))))
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "fixed.kd")
+            fixed_tree.save(path)
+            loaded = FlatKdTree.load(path, leaf_size=8)
+            self.assertTrue(loaded.fixed_point)
+            self.assertEqual(loaded.closest_node(Point(56.0033, 92.0041)).data,
+                             tree.closest_node(Point(56.0033, 92.0041)).data)
+            del loaded
+
+        with self.assertRaises(ValueError):
+            FlatKdTree(((Point(200, 0), None),), fixed_point=True)
+
+    def test_shared_memory(self):
+        tree = FlatKdTree(self.DATA)
+        block = tree.share()
+
+        try:
+            attached = FlatKdTree.attach(block.name)
+            self.assertEqual(len(attached), 200)
+            self.assertEqual(attached.closest_node(Point(15, 15)).data, tree.closest_node(Point(15, 15)).data)
+            self.assertEqual([node.data for node in attached.check_entry(Point(5, 2), Point(20, 9))],
+                             [node.data for node in tree.check_entry(Point(5, 2), Point(20, 9))])
+            with self.assertRaises(ValueError):
+                attached._xs[0] = 1
+
+            attached.close()
+            self.assertEqual(len(attached), 0)
+        finally:
+            block.close()
+            block.unlink()
+
+    def test_shared_memory_processes(self):
+        tree = FlatKdTree(self.DATA)
+        block = tree.share()
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        code = ("import sys\n"
+                "from python.logic.point import Point\n"
+                "from python.logic.tree.flat_tree import FlatKdTree\n"
+                "tree = FlatKdTree.attach(sys.argv[1])\n"
+                "print(tree.closest_node(Point(15, 15)).data['id'])\n"
+                "tree.close()\n")
+
+        try:
+            # The block must outlive every independent worker which attached to it
+            for _ in range(2):
+                worker = subprocess.run([sys.executable, "-c", code, block.name], cwd=root,
+                                        capture_output=True, text=True, check=True)
+                self.assertEqual(int(worker.stdout), tree.closest_node(Point(15, 15)).data["id"])
+
+            attached = FlatKdTree.attach(block.name)
+            self.assertEqual(len(attached), 200)
+            attached.close()
+        finally:
+            block.close()
+            block.unlink()
+
+    def test_shared_memory_pool(self):
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        # The resource tracker of the publisher prints its errors to the stderr of the publisher
+        code = ("import multiprocessing\n"
+                "from python.logic.tree.flat_tree import FlatKdTree\n"
+                "from python.tests.tests import TestFlatTree, attached_closest\n"
+                "block = FlatKdTree(TestFlatTree.DATA).share()\n"
+                "with multiprocessing.get_context('spawn').Pool(2) as pool:\n"
+                "    print(pool.map(attached_closest, [block.name] * 4))\n"
+                "block.close()\n"
+                "block.unlink()\n")
+
+        # Spawned workers share the resource tracker of the publisher, which must keep the registration
+        publisher = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+        expected = FlatKdTree(self.DATA).closest_node(Point(15, 15)).data["id"]
+        self.assertEqual(publisher.stdout.strip(), str([expected] * 4))
+        self.assertEqual(publisher.stderr, "")
+
+    def test_map_metric(self):
+        # A degree of longitude at 56 degrees of latitude is 0.56 of a degree of latitude
+        data = ((Point(56.6, 92), {"id": 0}), (Point(56, 92.9), {"id": 1}), (Point(55, 90), {"id": 2}))
+        pivot = Point(56, 92)
+
+        self.assertEqual(FlatKdTree(data).closest_node(pivot).data["id"], 0)
+        self.assertEqual(KdTreeMap(data).closest_node(pivot).data["id"], 1)
+        for fixed_point in (False, True):
+            self.assertEqual(FlatKdTreeMap(data, fixed_point=fixed_point).closest_node(pivot).data["id"], 1)
+
+        grid = [(Point(55 + i % 20 * 0.1, 90 + i // 20 * 0.1), {"id": i}) for i in range(400)]
+        tree = KdTreeMap(grid)
+        block = FlatKdTreeMap(grid, leaf_size=16).share()
+        try:
+            attached = FlatKdTreeMap.attach(block.name, leaf_size=16)
+            for lat, lon in ((56.03, 92.17), (55.51, 90.92), (54, 89), (57.1, 91.37)):
+                self.assertEqual(attached.closest_node(Point(lat, lon)).data, tree.closest_node(Point(lat, lon)).data)
+            attached.close()
+        finally:
+            block.close()
+            block.unlink()
+
+    def test_empty(self):
+        tree = FlatKdTree()
+        self.assertEqual(tree.get_root(), None)
+        self.assertEqual(tree.closest_node(Point(3, 3)), None)
+        self.assertEqual(tree.check_entry(Point(1, 1), Point(3, 3)), [])
+        self.assertEqual(tree.rebuild_tree(DATA_SHORT).point, Point(8, 7))
+
+
+class TestPointStore(unittest.TestCase):
+    RESULT = SimpleNamespace(
+        nodes=[SimpleNamespace(id=1, lat="56.01", lon="92.85", tags={"name": "a"}),
+               SimpleNamespace(id=2, lat="56.02", lon="92.86", tags={"name": "b"})],
+        ways=[SimpleNamespace(id=3, center_lat="56.03", center_lon="92.87", tags={"name": "c"})],
+        relations=[])
+
+    def test_from_result(self):
+        store = PointStore.from_result(self.RESULT)
+
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.osm_ids.tolist(), [3, 1, 2])
+        self.assertEqual([PointStore.TYPES[code] for code in store.osm_types], ["way", "node", "node"])
+        self.assertEqual(store.point(0), Point(56.03, 92.87))
+        self.assertEqual([tags["name"] for _, _, _, tags in store.rows()], ["c", "a", "b"])
+        self.assertFalse(PointStore())
+        with self.assertRaises(ValueError):
+            PointStore([1], [2], [3], [0], [])
+
+    def test_build_tree(self):
+        store = PointStore.from_result(self.RESULT)
+        tree = store.build_tree()
+
+        self.assertEqual(tree.closest_node(Point(56.011, 92.851)).data, 1)
+        self.assertEqual(tree.count_within_radius(Point(56.02, 92.86), 2000), 3)
+
+    def test_fixed_point(self):
+        store = PointStore.from_result(self.RESULT, fixed_point=True)
+
+        self.assertEqual(store.point(1), Point(56.01, 92.85))
+        self.assertEqual(store.lats.tolist(), [56.03, 56.01, 56.02])
+        self.assertEqual(store.build_tree().closest_node(Point(56.011, 92.851)).data, 1)
+
+
+class TestTagTable(unittest.TestCase):
+    TAGS = [{"amenity": "cafe", "name": "a"}, {}, {"name": "b", "amenity": "cafe", "cuisine": "coffee_shop"}]
+
+    def test_decode(self):
+        table = TagTable.from_dicts(self.TAGS)
+
+        self.assertEqual(len(table), 3)
+        self.assertEqual(list(table), self.TAGS)
+        self.assertEqual([table[row] for row in range(3)], self.TAGS)
+        self.assertEqual(table[-1], self.TAGS[2])
+        with self.assertRaises(IndexError):
+            table[3]
+        self.assertEqual(list(TagTable.from_dicts([])), [])
+
+    def test_decoded_copy(self):
+        table = TagTable.from_dicts(self.TAGS)
+        table[0]["name"] = "c"
+
+        self.assertEqual(table[0]["name"], "a")
+
+
+
+class TestMap(unittest.TestCase):
+    def setUp(self):
+        # The map is tested without the third party packages of the UI and the API
+        element = SimpleNamespace(Template=mock.MagicMock(), MacroElement=object, Element=mock.MagicMock())
+        modules = {"folium": mock.MagicMock(), "overpy": mock.MagicMock(), "overpy.exception": mock.MagicMock(),
+                   "branca": mock.MagicMock(), "branca.element": element}
+        for patcher in (mock.patch.dict(sys.modules, modules),
+                        mock.patch.object(JsonConnector, "get_icons", return_value={})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.map = importlib.import_module("..logic.map_generator", __package__).Map()
+        self.map._query = mock.MagicMock()
+        self.map._query.get_reserved.return_value = []
+        self.map._query.query_by_name.return_value = TestPointStore.RESULT
+
+    def test_tree_per_result(self):
+        patcher = mock.patch.object(PointStore, "build_tree", autospec=True, side_effect=PointStore.build_tree)
+        with patcher as build_tree:
+            self.map.find_objects("cafe", Point(56, 92), Point(57, 93))
+            self.assertEqual(build_tree.call_count, 0)
+
+            for _ in range(3):
+                self.assertIsNotNone(self.map.nearest_object(Point(56.011, 92.851), 2))
+                self.assertEqual(self.map.count_objects_in_radius(Point(56.02, 92.86), 2000), 3)
+            self.assertEqual(build_tree.call_count, 1)
+
+            # New objects drop the tree over the previous ones
+            self.map.find_objects("cafe", Point(56, 92), Point(57, 93))
+            self.assertEqual(self.map.count_objects_in_radius(Point(56.02, 92.86), 2000), 3)
+            self.assertEqual(build_tree.call_count, 2)
+
+            self.map.pure_map()
+            self.assertIsNone(self.map.nearest_object(Point(56.011, 92.851)))
+            self.assertEqual(self.map.count_objects_in_radius(Point(56.02, 92.86), 2000), 0)
+            self.assertEqual(build_tree.call_count, 2)
+
+            self.map.find_objects("cafe", Point(56, 92), Point(57, 93))
+            self.map.nearest_object(Point(56.011, 92.851))
+            self.assertEqual(build_tree.call_count, 3)
+
+
 if __name__ == '__main__':
     unittest.main()